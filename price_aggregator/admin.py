@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from price_aggregator.models import Currency, Provider, AggregatedPrice, ProviderResponse, \
-    ProviderFailure, ProviderBlackList, NuMarketMaker, ArbitrageOpportunity
+    ProviderFailure, ProviderBlackList, NuMarketMaker, ArbitrageOpportunity, ProviderCoverage
 
 
 @admin.register(Provider)
@@ -19,6 +19,13 @@ class ProviderResponseAdmin(admin.ModelAdmin):
     raw_id_fields = ['provider', 'currency']
 
 
+@admin.register(ProviderCoverage)
+class ProviderCoverageAdmin(admin.ModelAdmin):
+    list_display = ['provider', 'currency', 'last_seen']
+    list_filter = ['currency']
+    raw_id_fields = ['provider', 'currency']
+
+
 @admin.register(ProviderFailure)
 class ProviderFailureAdmin(admin.ModelAdmin):
     list_display = ['date_time', 'provider', 'message']
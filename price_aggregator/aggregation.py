@@ -0,0 +1,128 @@
+from collections import namedtuple
+
+import numpy as np
+
+# the ProviderResponse fields the aggregation works from, in the order to_arrays expects them
+RESPONSE_FIELDS = ('id', 'provider_id', 'value', 'volume', 'provider__exchange_provider')
+
+AggregateResult = namedtuple(
+    'AggregateResult',
+    [
+        'used_ids',
+        'weighted_ids',
+        'weighted_mean',
+        'weighted_mean_used',
+        'aggregated_price',
+        'providers',
+        'standard_deviation',
+        'variance'
+    ]
+)
+
+
+def to_arrays(rows):
+    """
+    Turn values_list rows of RESPONSE_FIELDS into numpy arrays of
+    ids, provider ids, values, volumes and exchange provider flags
+    """
+    if not rows:
+        return (
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=float),
+            np.empty(0, dtype=float),
+            np.empty(0, dtype=bool)
+        )
+
+    ids, provider_ids, values, volumes, exchange_providers = zip(*rows)
+
+    return (
+        np.array(ids, dtype=np.int64),
+        np.array(provider_ids, dtype=np.int64),
+        np.array(values, dtype=float),
+        # a missing volume becomes nan
+        np.array(volumes, dtype=float),
+        np.array(exchange_providers, dtype=bool)
+    )
+
+
+def first_per_provider(provider_ids):
+    """
+    Return a mask selecting the first response from each provider.
+    Responses are ordered newest first so this is the latest response from each
+    """
+    mask = np.zeros(len(provider_ids), dtype=bool)
+    _, first_index = np.unique(provider_ids, return_index=True)
+    mask[first_index] = True
+    return mask
+
+
+def inlier_mask(values):
+    """
+    Return a mask selecting the values that lie within 1.5 times the interquartile range of the quartiles
+    """
+    if not values.size:
+        return np.ones(0, dtype=bool)
+
+    quartile_1, quartile_3 = np.percentile(values, [25, 75])
+    iqr = quartile_3 - quartile_1
+    return (values >= quartile_1 - (iqr * 1.5)) & (values <= quartile_3 + (iqr * 1.5))
+
+
+def aggregate(ids, provider_ids, values, volumes, exchange_providers):
+    """
+    Calculate an aggregated price from the arrays produced by to_arrays.
+
+    Exchange provider (market) responses are combined into a single volume weighted mean
+    which is then treated like any other response.
+    The ids of the responses that were used are returned rather than the responses themselves.
+    weighted_mean_used indicates whether the weighted mean survived outlier removal
+    """
+    # skip nan values then take the latest response from each provider
+    valid = ~np.isnan(values)
+    valid[valid] = first_per_provider(provider_ids[valid])
+
+    weighted = valid & exchange_providers
+    standard = valid & ~exchange_providers
+
+    weighted_ids = ids[weighted]
+    weighted_values = values[weighted]
+    weighted_volumes = np.nan_to_num(volumes[weighted])
+    weighted_mean = None
+
+    if weighted_ids.size and weighted_volumes.sum() > 0.0:
+        # remove outliers then find the weighted mean
+        inliers = inlier_mask(weighted_values)
+
+        if weighted_volumes[inliers].sum() > 0.0:
+            weighted_mean = np.average(weighted_values[inliers], weights=weighted_volumes[inliers])
+        else:
+            weighted_mean = np.average(weighted_values[inliers])
+
+    candidate_values = values[standard]
+
+    if weighted_mean is not None:
+        candidate_values = np.append(candidate_values, weighted_mean)
+
+    # now we can remove outliers
+    cleaned = inlier_mask(candidate_values)
+    cleaned_values = candidate_values[cleaned]
+    positive_values = cleaned_values[cleaned_values > 0]
+
+    if positive_values.size:
+        aggregated_price = np.mean(positive_values)
+        standard_deviation = np.std(positive_values)
+        variance = np.var(positive_values)
+    else:
+        aggregated_price = standard_deviation = variance = float('nan')
+
+    return AggregateResult(
+        used_ids=ids[standard][cleaned[:standard.sum()]].tolist(),
+        weighted_ids=weighted_ids.tolist(),
+        weighted_mean=weighted_mean,
+        weighted_mean_used=weighted_mean is not None and bool(cleaned[-1]),
+        aggregated_price=aggregated_price,
+        providers=int(cleaned.sum()),
+        standard_deviation=standard_deviation,
+        variance=variance
+    )
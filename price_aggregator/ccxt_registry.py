@@ -0,0 +1,65 @@
+import time
+
+import ccxt
+from django.conf import settings
+
+
+class ExchangeRegistry(object):
+    """
+    Keep ccxt exchange instances and their markets for the life of the worker process.
+    Markets are fetched again once CCXT_MARKET_REFRESH_INTERVAL seconds have passed
+    """
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = (
+            refresh_interval if refresh_interval is not None else settings.CCXT_MARKET_REFRESH_INTERVAL
+        )
+        self.exchanges = {}
+        self.markets = {}
+        self.relevant_markets = {}
+
+    def get_exchange(self, exchange):
+        """
+        Return the wrapper for the named exchange, creating it on first use
+        """
+        if exchange not in self.exchanges:
+            self.exchanges[exchange] = getattr(ccxt, exchange)()
+
+        return self.exchanges[exchange]
+
+    def get_markets(self, exchange):
+        """
+        Return all markets for the named exchange
+        """
+        loaded_at, markets = self.markets.get(exchange, (None, None))
+
+        if loaded_at is None or time.monotonic() - loaded_at > self.refresh_interval:
+            # loading through the wrapper keeps its own markets current so ccxt doesn't fetch them again
+            markets = list(self.get_exchange(exchange).load_markets(reload=True).values())
+            self.markets[exchange] = (time.monotonic(), markets)
+            # any filtered markets came from the old list
+            self.relevant_markets.pop(exchange, None)
+
+        return markets
+
+    def get_relevant_markets(self, exchange, currency_codes):
+        """
+        Return the markets for the named exchange where both the base and quote are in currency_codes
+        """
+        currency_codes = frozenset(code.upper() for code in currency_codes)
+        markets = self.get_markets(exchange)
+        codes, relevant_markets = self.relevant_markets.get(exchange, (None, None))
+
+        if codes != currency_codes:
+            relevant_markets = [
+                market for market in markets
+                if market['base'] is not None
+                and market['quote'] is not None
+                and market['base'].upper() in currency_codes
+                and market['quote'].upper() in currency_codes
+            ]
+            self.relevant_markets[exchange] = (currency_codes, relevant_markets)
+
+        return relevant_markets
+
+
+exchange_registry = ExchangeRegistry()
@@ -0,0 +1,83 @@
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import JsonWebsocketConsumer
+
+# channel layer group names only allow a limited set of characters
+VALID_CODE = re.compile(r'^[a-z0-9]{1,10}$')
+
+
+def price_group_name(currency_code):
+    return 'prices_{}'.format(currency_code.lower())
+
+
+def clean_codes(codes):
+    """
+    Lower case the currency codes and drop any that can't be used in a group name
+    """
+    cleaned_codes = set()
+
+    for code in codes:
+        code = code.strip().lower()
+
+        # Bittrex still calls USNBT NBT!
+        if code == 'nbt':
+            code = 'usnbt'
+
+        if VALID_CODE.match(code):
+            cleaned_codes.add(code)
+
+    return cleaned_codes
+
+
+def is_code_list(codes):
+    return isinstance(codes, list) and all(isinstance(code, str) for code in codes)
+
+
+class PriceConsumer(JsonWebsocketConsumer):
+    """
+    Push each new aggregated price to the client as soon as it is saved.
+    Currencies are chosen with ?codes=btc,eth when connecting
+    or by sending {"subscribe": ["btc"]} and {"unsubscribe": ["btc"]}.
+    Prices are sent in the same form as /price/<currency_code>
+    """
+    def connect(self):
+        self.codes = set()
+        self.accept()
+
+        query = parse_qs(self.scope['query_string'].decode())
+
+        for codes in query.get('codes', []):
+            self.subscribe(codes.split(','))
+
+    def disconnect(self, close_code):
+        self.unsubscribe(list(self.codes))
+
+    def receive_json(self, content, **kwargs):
+        if not isinstance(content, dict):
+            self.send_json({'error': 'messages need to be objects'})
+            return
+
+        for action in ('subscribe', 'unsubscribe'):
+            if not is_code_list(content.get(action, [])):
+                self.send_json({'error': '{} needs to be a list of currency codes'.format(action)})
+                return
+
+        self.subscribe(content.get('subscribe', []))
+        self.unsubscribe(content.get('unsubscribe', []))
+        self.send_json({'subscribed': sorted(self.codes)})
+
+    def subscribe(self, codes):
+        for code in clean_codes(codes) - self.codes:
+            async_to_sync(self.channel_layer.group_add)(price_group_name(code), self.channel_name)
+            self.codes.add(code)
+
+    def unsubscribe(self, codes):
+        for code in clean_codes(codes) & self.codes:
+            async_to_sync(self.channel_layer.group_discard)(price_group_name(code), self.channel_name)
+            self.codes.discard(code)
+
+    def price_update(self, event):
+        # the price was rendered when it was aggregated so is sent as it is
+        self.send(text_data=event['price'])
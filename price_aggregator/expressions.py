@@ -0,0 +1,27 @@
+from django.db import models
+from django.db.models import Aggregate, Func
+
+
+class EpochBucket(Func):
+    """
+    The start of the fixed size bucket a datetime falls into, as a unix timestamp.
+    interval is the bucket size in seconds
+    """
+    template = 'CAST(FLOOR(EXTRACT(EPOCH FROM %(expressions)s) / %(interval)s) * %(interval)s AS BIGINT)'
+    output_field = models.BigIntegerField()
+
+    def __init__(self, expression, interval, **extra):
+        super().__init__(expression, interval=int(interval), **extra)
+
+
+class FirstValue(Aggregate):
+    """
+    The first value in a group when the group is ordered by the ordering expression.
+    Use F('date_time').asc() for the opening value and F('date_time').desc() for the closing one
+    """
+    function = 'ARRAY_AGG'
+    template = '(%(function)s(%(expressions)s))[1]'
+    arg_joiner = ' ORDER BY '
+
+    def __init__(self, expression, ordering, **extra):
+        super().__init__(expression, ordering, **extra)
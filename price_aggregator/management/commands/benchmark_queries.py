@@ -0,0 +1,232 @@
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.migrations.exceptions import AmbiguityError
+from django.db.migrations.loader import MigrationLoader
+from django.utils.timezone import now
+
+from price_aggregator.aggregation import RESPONSE_FIELDS
+from price_aggregator.models import AggregatedPrice, Currency, Provider, ProviderResponse
+
+
+class Command(BaseCommand):
+    help = 'Show the query plans of the hot queries and measure insert throughput. ' \
+           'Use --compare to also show the plans with the indexes of an earlier migration'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-i',
+            '--inserts',
+            help='how many rows to insert when measuring insert throughput',
+            dest='inserts',
+            type=int,
+            default=5000
+        )
+        parser.add_argument(
+            '-a',
+            '--analyze',
+            help='run the queries to show actual timings in the plans',
+            action='store_true'
+        )
+        parser.add_argument(
+            '-c',
+            '--compare',
+            help='also show the plans with the indexes as they were after the named price_aggregator migration, '
+                 'e.g. 0028. PostgreSQL only. The indexes are swapped in a transaction that is rolled back, '
+                 'which locks the tables meanwhile so run this against a copy of the database',
+            dest='compare'
+        )
+
+    def handle(self, *args, **options):
+        currency = Currency.objects.first()
+        provider = Provider.objects.first()
+
+        if currency is None or provider is None:
+            raise CommandError('At least one Currency and one Provider are needed to benchmark against')
+
+        explain_options = {}
+
+        if options['analyze'] and connection.vendor == 'postgresql':
+            explain_options = {'analyze': True, 'buffers': True}
+
+        if options['compare']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('Comparing index sets needs PostgreSQL')
+
+            with transaction.atomic():
+                migration = self.use_indexes_from(options['compare'])
+                self.stdout.write('=== plans with the indexes as of {}'.format(migration))
+                self.show_plans(currency, provider, explain_options)
+                transaction.set_rollback(True)
+
+            self.stdout.write('=== plans with the current indexes')
+
+        self.show_plans(currency, provider, explain_options)
+        self.benchmark_inserts(currency, provider, options['inserts'])
+
+    def show_plans(self, currency, provider, explain_options):
+        for name, queryset in self.hot_queries(currency, provider):
+            self.stdout.write('--- {}'.format(name))
+            self.stdout.write(queryset.explain(**explain_options))
+
+    @staticmethod
+    def use_indexes_from(migration_prefix):
+        """
+        Swap the indexes of the benchmarked tables for the ones they had after the named migration.
+        This is meant to be run in a transaction that is rolled back. Returns the full name of the migration
+        """
+        loader = MigrationLoader(connection)
+
+        try:
+            migration = loader.get_migration_by_prefix('price_aggregator', migration_prefix)
+        except (AmbiguityError, KeyError) as e:
+            raise CommandError('Cannot find migration {}: {}'.format(migration_prefix, e))
+
+        old_state = loader.project_state((migration.app_label, migration.name))
+        current_state = loader.project_state()
+
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for model in (ProviderResponse, AggregatedPrice):
+                old_model = old_state.apps.get_model('price_aggregator', model._meta.model_name)
+                current_model = current_state.apps.get_model('price_aggregator', model._meta.model_name)
+                old_indexes = {index.name: index for index in old_model._meta.indexes}
+                current_indexes = {index.name: index for index in current_model._meta.indexes}
+
+                for name, index in current_indexes.items():
+                    if name not in old_indexes:
+                        schema_editor.remove_index(current_model, index)
+
+                for name, index in old_indexes.items():
+                    if name not in current_indexes:
+                        schema_editor.add_index(old_model, index)
+
+                for field in current_model._meta.local_fields:
+                    old_field = old_model._meta.get_field(field.name)
+
+                    if field.db_index != old_field.db_index:
+                        schema_editor.alter_field(current_model, field, old_field)
+
+        return migration.name
+
+    @staticmethod
+    def hot_queries(currency, provider):
+        """
+        The queries the api and the aggregation run most, as (name, queryset) pairs
+        """
+        last_day = now() - timedelta(days=1)
+
+        return [
+            (
+                'live responses for a currency',
+                ProviderResponse.objects.live().filter(
+                    currency=currency
+                ).order_by(
+                    '-date_time'
+                ).values_list(
+                    *RESPONSE_FIELDS
+                )
+            ),
+            (
+                'live responses for every currency',
+                ProviderResponse.objects.live().order_by(
+                    'currency',
+                    '-date_time'
+                ).values_list(
+                    'currency_id',
+                    *RESPONSE_FIELDS
+                )
+            ),
+            (
+                'latest provider response for a currency',
+                ProviderResponse.objects.filter(
+                    provider=provider,
+                    currency=currency
+                ).order_by(
+                    '-date_time'
+                )[:1]
+            ),
+            (
+                'provider responses for the last day',
+                ProviderResponse.objects.filter(
+                    provider=provider,
+                    date_time__gte=last_day
+                ).order_by(
+                    'currency',
+                    'date_time'
+                ).values_list(
+                    'currency__code',
+                    'date_time',
+                    'value'
+                )
+            ),
+            (
+                'combined responses',
+                ProviderResponse.objects.filter(
+                    parent_response_id=0
+                )
+            ),
+            (
+                'aggregated price closest to a time',
+                AggregatedPrice.objects.filter(
+                    currency=currency,
+                    date_time__lt=last_day
+                ).order_by(
+                    '-date_time'
+                )[:1]
+            ),
+            (
+                'aggregated prices for the last day',
+                AggregatedPrice.objects.filter(
+                    currency=currency,
+                    date_time__gte=last_day
+                ).values_list(
+                    'aggregated_price',
+                    flat=True
+                )
+            ),
+            (
+                'latest aggregated price per currency',
+                AggregatedPrice.objects.latest_per_currency()
+            )
+        ]
+
+    def benchmark_inserts(self, currency, provider, inserts):
+        """
+        Time inserting rows the way the response sink and the aggregation do.
+        Everything is rolled back afterwards
+        """
+        with transaction.atomic():
+            start = time.perf_counter()
+            ProviderResponse.objects.bulk_create(
+                [
+                    ProviderResponse(
+                        provider=provider,
+                        currency=currency,
+                        value=1,
+                        update_by=now()
+                    ) for _ in range(inserts)
+                ],
+                batch_size=1000
+            )
+            response_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            AggregatedPrice.objects.bulk_create(
+                [
+                    AggregatedPrice(
+                        currency=currency,
+                        aggregated_price=1,
+                        providers=1
+                    ) for _ in range(inserts)
+                ],
+                batch_size=1000
+            )
+            price_time = time.perf_counter() - start
+
+            transaction.set_rollback(True)
+
+        self.stdout.write('--- insert throughput')
+        self.stdout.write('ProviderResponse: {:.0f} rows/s'.format(inserts / response_time))
+        self.stdout.write('AggregatedPrice: {:.0f} rows/s'.format(inserts / price_time))
@@ -7,7 +7,8 @@ import numpy as np
 from django.core.management import BaseCommand
 from django.utils.timezone import now
 
-from price_aggregator.models import Currency, AggregatedPrice, ProviderResponse, Provider
+from price_aggregator.models import Currency, AggregatedPrice, ProviderResponse, Provider, ProviderCoverage
+from price_aggregator.snapshots import store_price_snapshots
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +78,7 @@ class Command(BaseCommand):
                 currency=currency,
                 update_by=now()
             )
+            ProviderCoverage.objects.record([calc_response])
 
             # add the responses that were used here
             for response in weighted_responses:
@@ -103,6 +105,8 @@ class Command(BaseCommand):
         # if we got here we should lock
         open('aggregates.lock', 'w+').close()
 
+        aggregated_prices = []
+
         for currency in Currency.objects.all():
             logger.info('Working on {}'.format(currency))
 
@@ -148,5 +152,10 @@ class Command(BaseCommand):
             for resp in cleaned_responses:
                 aggregated_price.used_responses.add(resp)
 
+            aggregated_prices.append(aggregated_price)
+
+        # the cached snapshots would otherwise keep serving the previous prices
+        store_price_snapshots(aggregated_prices)
+
         # we're done. remove the lock
         os.remove('aggregates.lock')
\ No newline at end of file
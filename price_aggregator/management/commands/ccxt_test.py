@@ -7,7 +7,8 @@ import ccxt
 from django.core.management import BaseCommand
 from django.utils.timezone import now
 
-from price_aggregator.models import Currency, AggregatedPrice, Provider, ProviderBlackList, ProviderResponse
+from price_aggregator.models import Currency, AggregatedPrice, Provider, ProviderBlackList, ProviderResponse, \
+    ProviderCoverage
 
 logger = logging.getLogger(__name__)
 
@@ -143,7 +144,7 @@ class Command(BaseCommand):
 
             logger.info('Saving {} from {}: {:.8f}'.format(price['coin'], price_provider.name, price['price']))
 
-            ProviderResponse.objects.create(
+            response = ProviderResponse.objects.create(
                 provider=price_provider,
                 currency=price['coin'],
                 value=price['price'],
@@ -151,3 +152,4 @@ class Command(BaseCommand):
                 volume=price.get('volume'),
                 update_by=now() + timedelta(seconds=price_provider.cache)
             )
+            ProviderCoverage.objects.record([response])
@@ -5,7 +5,8 @@ from django.core.management import BaseCommand
 from django.utils.timezone import now
 
 from price_aggregator import providers
-from price_aggregator.models import Currency, ProviderFailure, ProviderResponse, Provider, ProviderBlackList
+from price_aggregator.models import Currency, ProviderFailure, ProviderResponse, Provider
+from price_aggregator.response_sink import response_sink
 
 logger = logging.getLogger(__name__)
 
@@ -86,31 +87,20 @@ class Command(BaseCommand):
                 continue
 
             # we have some price data
-            for price in prices:
-                try:
-                    provider = Provider.objects.get(name__iexact=price.get('provider', provider_name))
-                except Provider.DoesNotExist:
-                    provider = Provider.objects.create(name=price.get('provider', provider_name))
-                # if the provider is blacklisted, we skip
-                try:
-                    ProviderBlackList.objects.get(currency=price['coin'], provider=provider)
-                    continue
-                except ProviderBlackList.DoesNotExist:
-                    pass
-
-                if options['skip_save']:
+            if options['skip_save']:
+                for price in prices:
                     logger.info(
-                        'Skipping save of {} from {}: {:.8f}'.format(price['coin'], provider.name, price['price'])
+                        'Skipping save of {} from {}: {:.8f}'.format(
+                            price['coin'],
+                            price.get('provider', provider_name),
+                            price['price']
+                        )
                     )
-                    continue
-
-                logger.info('Saving {} from {}: {:.8f}'.format(price['coin'], provider.name, price['price']))
+                continue
 
-                ProviderResponse.objects.create(
-                    provider=provider,
-                    currency=price['coin'],
-                    value=price['price'],
-                    market_value=price.get('market_price', 0),
-                    volume=price.get('volume'),
-                    update_by=now() + timedelta(seconds=provider.cache)
-                )
\ No newline at end of file
+            response_sink.save(
+                prices,
+                provider_name=provider_name,
+                exchange_provider=provider.exchange_provider,
+                cache=provider.cache
+            )
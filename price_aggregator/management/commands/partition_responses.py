@@ -0,0 +1,83 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.utils.timezone import now
+
+from price_aggregator import partitions
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Manage the date_time partitions of the ProviderResponse table on PostgreSQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-c',
+            '--convert',
+            help='convert the existing ProviderResponse table into a partitioned table',
+            action='store_true'
+        )
+        parser.add_argument(
+            '-r',
+            '--revert',
+            help='turn the partitioned ProviderResponse table back into a plain table, '
+                 'which copies every response. Migrations that alter ProviderResponse need this first',
+            action='store_true'
+        )
+        parser.add_argument(
+            '-d',
+            '--drop',
+            help='drop the partitions older than PROVIDER_RESPONSE_RETENTION_DAYS',
+            action='store_true'
+        )
+        parser.add_argument(
+            '-l',
+            '--list',
+            help='list the partitions',
+            action='store_true'
+        )
+
+    def handle(self, *args, **options):
+        interval = settings.PROVIDER_RESPONSE_PARTITION_INTERVAL
+
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL')
+
+        if (options['convert'] or options['revert']) and partitions.has_unapplied_migrations():
+            raise CommandError('Apply the migrations before converting or reverting ProviderResponse')
+
+        if options['revert']:
+            if not partitions.is_partitioned():
+                raise CommandError('ProviderResponse is not partitioned')
+
+            partitions.revert()
+            return
+
+        if interval not in partitions.PARTITION_INTERVALS:
+            raise CommandError(
+                'Set PROVIDER_RESPONSE_PARTITION_INTERVAL to one of {}'.format(
+                    ', '.join(partitions.PARTITION_INTERVALS)
+                )
+            )
+
+        if options['convert']:
+            if partitions.is_partitioned():
+                raise CommandError('ProviderResponse is already partitioned')
+
+            partitions.convert(interval)
+
+        if not partitions.is_partitioned():
+            raise CommandError('ProviderResponse is not partitioned. Run with --convert first')
+
+        partitions.create_partitions(interval, settings.PROVIDER_RESPONSE_PARTITIONS_AHEAD)
+
+        if options['drop']:
+            partitions.drop_partitions(now() - timedelta(days=settings.PROVIDER_RESPONSE_RETENTION_DAYS))
+
+        if options['list']:
+            for name, upper in partitions.get_partitions():
+                logger.info('{} up to {}'.format(name, upper if upper is not None else 'anything'))
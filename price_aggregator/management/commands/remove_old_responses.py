@@ -2,34 +2,107 @@ import logging
 import time
 from datetime import timedelta
 
+from django.conf import settings
 from django.core.management import BaseCommand
-from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Max, Min
 from django.utils.timezone import now
 
-from price_aggregator.models import ProviderResponse, AggregatedPrice
+from price_aggregator import partitions, retention
+from price_aggregator.models import ProviderResponse
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
+    help = 'Delete old responses in batches of primary key ranges. ' \
+           'Each batch is committed on its own so the command can be stopped and run again to carry on'
+
     def add_arguments(self, parser):
         parser.add_argument(
             '-d',
             '--days',
             help='how many days ago to delete responses before',
             dest='days',
-            default=30
+            default=settings.PROVIDER_RESPONSE_RETENTION_DAYS
+        )
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            help='how many primary keys each batch covers',
+            dest='batch_size',
+            type=int,
+            default=5000
+        )
+        parser.add_argument(
+            '-s',
+            '--sleep',
+            help='how many seconds to wait between batches to leave room for other queries',
+            dest='sleep',
+            type=float,
+            default=0.5
         )
 
     def handle(self, *args, **options):
-        responses = ProviderResponse.objects.filter(
-            date_time__lte=now() - timedelta(days=int(options['days']))
-        ).order_by('date_time')
+        cutoff = now() - timedelta(days=int(options['days']))
+
+        # whole partitions of old responses can simply be dropped
+        if partitions.is_partitioned():
+            dropped = partitions.drop_partitions(cutoff)
+            logger.info(f'Dropped {len(dropped)} partitions')
+
+        # ids aren't strictly in date_time order so the whole range of expired ids is covered
+        id_range = ProviderResponse.objects.filter(
+            date_time__lte=cutoff
+        ).aggregate(
+            first_id=Min('pk'),
+            last_id=Max('pk')
+        )
+        first_id, last_id = id_range['first_id'], id_range['last_id']
+
+        if first_id is None:
+            logger.info('No responses to delete')
+            return
+
+        logger.info(f'Deleting responses up to {cutoff} with ids from {first_id} to {last_id}')
+
+        start = time.monotonic()
+        total = 0
+
+        for batch_start in range(first_id, last_id + 1, options['batch_size']):
+            batch_time = time.monotonic()
+            deleted = self.delete_batch(batch_start, batch_start + options['batch_size'], cutoff)
+            batch_time = time.monotonic() - batch_time
+            total += deleted
+
+            logger.info(
+                f'Deleted {deleted} responses with ids from {batch_start} in {batch_time:.2f}s. '
+                f'{total} so far at {total / (time.monotonic() - start):.0f} responses/s'
+            )
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        logger.info(f'Deleted {total} responses in {time.monotonic() - start:.0f}s')
 
-        logger.info(f'Deleting {responses.count()} responses')
-        time.sleep(2)
+    def delete_batch(self, start_id, end_id, cutoff):
+        """
+        Delete the expired responses with ids from start_id up to end_id in a single transaction,
+        along with the responses combined into them.
+        Rows pointing at the responses are removed or unlinked first. Returns the number of responses deleted
+        """
+        table = retention.quote(ProviderResponse._meta.db_table)
+        # the batch is picked by a range of ids rather than a list of them
+        # so the statements don't grow with the batch size
+        batch = 'id >= %s AND id < %s AND date_time <= %s'
+        params = [start_id, end_id, cutoff]
 
-        for response in responses:
-            logger.info(f'Deleting {response}')
-            logger.info(response.delete())
+        with transaction.atomic(), connection.cursor() as cursor:
+            deleted = retention.delete_response_dependents(
+                cursor,
+                'SELECT id FROM {} WHERE {}'.format(table, batch),
+                params
+            )
+            cursor.execute('DELETE FROM {} WHERE {}'.format(table, batch), params)
 
+            return deleted + cursor.rowcount
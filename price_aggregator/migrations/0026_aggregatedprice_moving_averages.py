@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('price_aggregator', '0025_arbitrageopportunity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregatedprice',
+            name='moving_averages',
+            field=models.JSONField(blank=True, help_text='The moving averages as they were when this price was aggregated', null=True),
+        ),
+    ]
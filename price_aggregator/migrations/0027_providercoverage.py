@@ -0,0 +1,56 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:14
+
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def fill_coverage(apps, schema_editor):
+    """
+    Build the coverage from the existing responses with a single grouped query
+    """
+    ProviderCoverage = apps.get_model('price_aggregator', 'ProviderCoverage')
+    ProviderResponse = apps.get_model('price_aggregator', 'ProviderResponse')
+
+    ProviderCoverage.objects.bulk_create(
+        [
+            ProviderCoverage(
+                provider_id=provider_id,
+                currency_id=currency_id,
+                last_seen=last_seen
+            ) for provider_id, currency_id, last_seen in ProviderResponse.objects.order_by().values(
+                'provider_id',
+                'currency_id'
+            ).annotate(
+                last_seen=Max('date_time')
+            ).values_list(
+                'provider_id',
+                'currency_id',
+                'last_seen'
+            )
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('price_aggregator', '0026_aggregatedprice_moving_averages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderCoverage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_seen', models.DateTimeField(db_index=True)),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='price_aggregator.currency')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='price_aggregator.provider')),
+            ],
+            options={
+                'unique_together': {('provider', 'currency')},
+            },
+        ),
+        migrations.RunPython(fill_coverage, migrations.RunPython.noop),
+    ]
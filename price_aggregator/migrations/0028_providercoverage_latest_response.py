@@ -0,0 +1,42 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:15
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_latest_responses(apps, schema_editor):
+    """
+    Point each coverage row at the latest response for its pair in a single update
+    """
+    ProviderCoverage = apps.get_model('price_aggregator', 'ProviderCoverage')
+    ProviderResponse = apps.get_model('price_aggregator', 'ProviderResponse')
+
+    ProviderCoverage.objects.update(
+        latest_response=Subquery(
+            ProviderResponse.objects.filter(
+                provider=OuterRef('provider'),
+                currency=OuterRef('currency')
+            ).order_by(
+                '-date_time'
+            ).values(
+                'pk'
+            )[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('price_aggregator', '0027_providercoverage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='providercoverage',
+            name='latest_response',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='price_aggregator.providerresponse'),
+        ),
+        migrations.RunPython(fill_latest_responses, migrations.RunPython.noop),
+    ]
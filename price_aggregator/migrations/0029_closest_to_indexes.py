@@ -0,0 +1,24 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:17
+
+from django.db import migrations, models
+import price_aggregator.operations
+
+
+class Migration(migrations.Migration):
+    # the indexes are built concurrently so responses can still be saved while they are
+    atomic = False
+
+    dependencies = [
+        ('price_aggregator', '0028_providercoverage_latest_response'),
+    ]
+
+    operations = [
+        price_aggregator.operations.AddIndexConcurrently(
+            model_name='aggregatedprice',
+            index=models.Index(fields=['currency', 'date_time'], name='price_aggre_currenc_e38836_idx'),
+        ),
+        price_aggregator.operations.AddIndexConcurrently(
+            model_name='providerresponse',
+            index=models.Index(fields=['provider', 'currency', 'date_time'], name='price_aggre_provide_2fd928_idx'),
+        ),
+    ]
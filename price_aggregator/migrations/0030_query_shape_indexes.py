@@ -0,0 +1,59 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+import price_aggregator.operations
+
+
+class Migration(migrations.Migration):
+    # the indexes are built concurrently so responses can still be saved while they are
+    atomic = False
+
+    dependencies = [
+        ('price_aggregator', '0029_closest_to_indexes'),
+    ]
+
+    operations = [
+        price_aggregator.operations.AlterFieldIndexConcurrently(
+            model_name='aggregatedprice',
+            name='aggregated_price',
+            field=models.DecimalField(decimal_places=10, max_digits=25),
+        ),
+        price_aggregator.operations.AlterFieldIndexConcurrently(
+            model_name='aggregatedprice',
+            name='currency',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='price_aggregator.currency'),
+        ),
+        price_aggregator.operations.AlterFieldIndexConcurrently(
+            model_name='aggregatedprice',
+            name='providers',
+            field=models.DecimalField(decimal_places=10, default=0, max_digits=25),
+        ),
+        price_aggregator.operations.AlterFieldIndexConcurrently(
+            model_name='providerresponse',
+            name='currency',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='price_aggregator.currency'),
+        ),
+        price_aggregator.operations.AlterFieldIndexConcurrently(
+            model_name='providerresponse',
+            name='parent_response',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='price_aggregator.providerresponse'),
+        ),
+        price_aggregator.operations.AlterFieldIndexConcurrently(
+            model_name='providerresponse',
+            name='provider',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='price_aggregator.provider'),
+        ),
+        price_aggregator.operations.AddIndexConcurrently(
+            model_name='providerresponse',
+            index=models.Index(fields=['currency', 'update_by'], name='price_aggre_currenc_80a978_idx'),
+        ),
+        price_aggregator.operations.AddIndexConcurrently(
+            model_name='providerresponse',
+            index=models.Index(fields=['provider', 'date_time'], name='price_aggre_provide_82d3fd_idx'),
+        ),
+        price_aggregator.operations.AddIndexConcurrently(
+            model_name='providerresponse',
+            index=models.Index(condition=models.Q(parent_response__isnull=False), fields=['parent_response'], name='providerresponse_parent_idx'),
+        ),
+    ]
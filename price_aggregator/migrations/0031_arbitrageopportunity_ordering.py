@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('price_aggregator', '0030_query_shape_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='arbitrageopportunity',
+            options={'ordering': ['-date_time']},
+        ),
+    ]
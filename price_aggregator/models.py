@@ -1,10 +1,20 @@
 import datetime
 import math
+import uuid
+from itertools import groupby
 from statistics import mean
 
-from django.db import models
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, models
+from django.db.models import Avg, Case, Count, ExpressionWrapper, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Sum, \
+    Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.timezone import now
 
+from price_aggregator.expressions import EpochBucket, FirstValue
+
 
 class Provider(models.Model):
     name = models.CharField(
@@ -45,25 +55,29 @@ class Currency(models.Model):
     class Meta:
         verbose_name_plural = 'Currencies'
 
-    def currency_movements(self):
+    def currency_movements(self, latest_agg_price=None):
         """
         Calculate the movements in price between a range of times and now.
         expressed as percentage movement
         """
         # get the latest aggregated price
-        latest_agg_price = self.aggregatedprice_set.order_by('date_time').last()
+        if latest_agg_price is None:
+            latest_agg_price = self.aggregatedprice_set.order_by('date_time').last()
 
         movements = {
             'latest_price': float('{:.8f}'.format(latest_agg_price.aggregated_price)),
             'number_of_days': {}
         }
 
-        for days in [1, 2, 3, 7, 14, 30]:
-            price = self.aggregatedprice_set.get_closest_to(
-                self,
-                latest_agg_price.date_time - datetime.timedelta(days=days)
-            )
+        movement_days = [1, 2, 3, 7, 14, 30]
+
+        # the closest prices to all of the days are found together
+        closest_prices = self.aggregatedprice_set.get_closest_to_many(
+            self,
+            [latest_agg_price.date_time - datetime.timedelta(days=days) for days in movement_days]
+        )
 
+        for days, price in zip(movement_days, closest_prices):
             factor = ((latest_agg_price.aggregated_price - price.aggregated_price) / price.aggregated_price)
 
             movements['number_of_days'][days] = {
@@ -103,43 +117,175 @@ class ProviderBlackList(models.Model):
     )
 
 
-class ProviderResponseManager(models.Manager):
-    def get_closest_to(self, provider, currency, target):
-        closest_greater_qs = self.filter(
-            provider=provider,
-            currency=currency,
-            date_time__gt=target
-        ).order_by(
-            'date_time'
+class ClosestToManager(models.Manager):
+    def closest_to_many(self, targets, **filters):
+        """
+        Get the row matching filters with the date_time closest to each of the targets,
+        in the same order as the targets.
+        The rows either side of every target are found with a single UNION ALL of LIMIT 1 queries
+        where the database allows it. Otherwise there are two queries for each target
+        """
+        closest_qs = [
+            (index, self.closest_qs(index, target, filters)) for index, target in enumerate(targets)
+        ]
+        if not closest_qs:
+            return []
+
+        candidates = {}
+
+        if connections[self.db].features.supports_slicing_ordering_in_compound:
+            queries = [query[:1] for index, queries in closest_qs for query in queries]
+
+            for row in queries[0].union(*queries[1:], all=True):
+                candidates.setdefault(row.target_index, []).append(row)
+        else:
+            for index, queries in closest_qs:
+                candidates[index] = [row for row in (query.first() for query in queries) if row is not None]
+
+        closest_rows = []
+
+        for index, target in enumerate(targets):
+            if not candidates.get(index):
+                raise self.model.DoesNotExist(
+                    "There is no closest value because there are no values."
+                )
+
+            closest_greater = next((row for row in candidates[index] if row.date_time > target), None)
+            closest_less = next((row for row in candidates[index] if row.date_time < target), None)
+
+            if closest_greater is None:
+                closest_rows.append(closest_less)
+            elif closest_less is None:
+                closest_rows.append(closest_greater)
+            elif closest_greater.date_time - target > target - closest_less.date_time:
+                closest_rows.append(closest_less)
+            else:
+                closest_rows.append(closest_greater)
+
+        return closest_rows
+
+    def closest_qs(self, index, target, filters):
+        """
+        The querysets for the closest row after and the closest row before the target.
+        Each row is marked with the index of its target
+        """
+        return [
+            self.filter(
+                date_time__gt=target,
+                **filters
+            ).annotate(
+                target_index=Value(index, output_field=models.IntegerField())
+            ).order_by(
+                'date_time'
+            ),
+            self.filter(
+                date_time__lt=target,
+                **filters
+            ).annotate(
+                target_index=Value(index, output_field=models.IntegerField())
+            ).order_by(
+                '-date_time'
+            )
+        ]
+
+
+class ProviderResponseManager(ClosestToManager):
+    # the moving averages calculated for each response, in minutes
+    MOVING_AVERAGE_PERIODS = {
+        '30_minute': 30
+    }
+
+    def live(self):
+        """
+        Get the responses from active providers that haven't passed their update_by time.
+        update_by is never more than the longest provider cache after date_time so date_time is bounded too,
+        which lets a partitioned table skip all but the most recent partitions
+        """
+        longest_cache = Provider.objects.aggregate(longest_cache=Max('cache'))['longest_cache'] or 0
+
+        return self.filter(
+            update_by__gte=now(),
+            date_time__gte=now() - datetime.timedelta(seconds=longest_cache + 60),
+            provider__active=True
         )
 
-        closest_less_qs = self.filter(
-            provider=provider,
-            currency=currency,
-            date_time__lt=target
-        ).order_by(
-            '-date_time'
+    def serializable(self):
+        """
+        Get responses with everything serialize() uses fetched up front.
+        The provider and currency are joined and the combined responses prefetched
+        """
+        return self.select_related(
+            'provider',
+            'currency'
+        ).prefetch_related(
+            Prefetch(
+                'providerresponse_set',
+                queryset=self.select_related(
+                    'provider',
+                    'currency'
+                ).prefetch_related(
+                    'providerresponse_set'
+                )
+            )
         )
 
-        try:
-            try:
-                closest_greater = closest_greater_qs[0]
-            except IndexError:
-                return closest_less_qs[0]
-
-            try:
-                closest_less = closest_less_qs[0]
-            except IndexError:
-                return closest_greater_qs[0]
-        except IndexError:
-            raise self.model.DoesNotExist(
-                "There is no closest value because there are no values."
+    def calculate_moving_averages(self, responses):
+        """
+        Calculate the moving averages for many responses in a single query.
+        Each window is averaged in the database by a correlated subquery over the
+        responses from the same provider and currency since the start of the window.
+        As before, the window runs up to now rather than stopping at the response itself.
+        Returns the moving averages keyed by response pk
+        """
+        window_values = {}
+
+        for period, minutes in self.MOVING_AVERAGE_PERIODS.items():
+            window = self.filter(
+                provider=OuterRef('provider'),
+                currency=OuterRef('currency'),
+                date_time__gte=ExpressionWrapper(
+                    OuterRef('date_time') - datetime.timedelta(minutes=minutes),
+                    output_field=models.DateTimeField()
+                )
+            ).order_by().values(
+                'provider'
+            )
+            window_values['{}_avg'.format(period)] = Subquery(
+                window.annotate(avg=Avg('value')).values('avg'),
+                output_field=models.DecimalField()
+            )
+            window_values['{}_count'.format(period)] = Subquery(
+                window.annotate(count=Count('pk')).values('count'),
+                output_field=models.IntegerField()
             )
 
-        if closest_greater.date_time - target > target - closest_less.date_time:
-            return closest_less
-        else:
-            return closest_greater
+        moving_averages = {}
+
+        for window in self.filter(
+            pk__in=[response.pk for response in responses]
+        ).order_by().values(
+            'pk'
+        ).annotate(
+            **window_values
+        ):
+            moving_averages[window['pk']] = {}
+
+            for period in self.MOVING_AVERAGE_PERIODS:
+                avg = window['{}_avg'.format(period)]
+
+                if (window['{}_count'.format(period)] or 0) > 1 and not math.isnan(avg):
+                    moving_averages[window['pk']][period] = float('{:.8f}'.format(avg))
+
+        return moving_averages
+
+    def get_closest_to(self, provider, currency, target):
+        return self.get_closest_to_many(provider, currency, [target])[0]
+
+    def get_closest_to_many(self, provider, currency, targets):
+        """
+        Get the response from the provider for the currency closest to each of the targets with a single query
+        """
+        return self.closest_to_many(targets, provider=provider, currency=currency)
 
 
 class ProviderResponse(models.Model):
@@ -147,15 +293,16 @@ class ProviderResponse(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    # provider and currency lookups are served by the composite indexes in Meta
     provider = models.ForeignKey(
         Provider,
         on_delete=models.CASCADE,
-        db_index=True
+        db_index=False
     )
     currency = models.ForeignKey(
         Currency,
         on_delete=models.CASCADE,
-        db_index=True
+        db_index=False
     )
     value = models.DecimalField(
         decimal_places=10,
@@ -177,7 +324,8 @@ class ProviderResponse(models.Model):
         'ProviderResponse',
         on_delete=models.CASCADE,
         blank=True,
-        null=True
+        null=True,
+        db_index=False
     )
     update_by = models.DateTimeField(
         db_index=True
@@ -195,51 +343,48 @@ class ProviderResponse(models.Model):
 
     class Meta:
         ordering = ['-date_time']
+        indexes = [
+            # live responses for a currency
+            models.Index(fields=['currency', 'update_by']),
+            # a provider's responses for a currency over time
+            models.Index(fields=['provider', 'currency', 'date_time']),
+            # a provider's recent responses
+            models.Index(fields=['provider', 'date_time']),
+            # only the responses combined into a volume weighted mean have a parent
+            models.Index(
+                fields=['parent_response'],
+                name='providerresponse_parent_idx',
+                condition=Q(parent_response__isnull=False)
+            )
+        ]
 
     def calculate_moving_averages(self):
         """
-        Get the previous 24 hours values and calculate various moving averages
+        Get the moving averages of the values leading up to this response
         :return:
         """
-        values = ProviderResponse.objects.filter(
-            provider=self.provider,
-            currency=self.currency,
-            date_time__gt=(self.date_time - datetime.timedelta(hours=24))
-        )
-
-        if not values:
-            return {}
-
-        # calculate the moving averages
-        moving_averages = {
-            '30_minute': 30
-        }
-
-        for period in moving_averages.copy():
-            agg_list = values.filter(
-                date_time__gte=(self.date_time - datetime.timedelta(minutes=moving_averages[period]))
-            ).values_list('value', flat=True)
-
-            if len(agg_list) > 1:
-                avg = mean(agg_list)
+        return ProviderResponse.objects.calculate_moving_averages([self]).get(self.pk, {})
 
-                if not math.isnan(avg):
-                    moving_averages[period] = float('{:.8f}'.format(mean(agg_list)))
-                else:
-                    del moving_averages[period]
-            else:
-                del moving_averages[period]
+    def serialize(self, moving_averages=None):
+        """
+        moving_averages can be given as the moving averages of many responses keyed by pk,
+        as returned by ProviderResponse.objects.calculate_moving_averages.
+        Otherwise they are calculated for this response and its combined responses together
+        """
+        combined_responses = self.providerresponse_set.all()
 
-        return moving_averages
+        if moving_averages is None:
+            moving_averages = ProviderResponse.objects.calculate_moving_averages(
+                [self] + list(combined_responses)
+            )
 
-    def serialize(self):
         serialized_data = {
             'provider': self.provider.name,
             'currency': self.currency.code,
             'currency_name': self.currency.name,
             'date_time': self.date_time,
             'usd_price': float('{:.8f}'.format(self.value)),
-            'moving_averages': self.calculate_moving_averages()
+            'moving_averages': moving_averages.get(self.pk, {})
         }
 
         if self.date_time < (now() - datetime.timedelta(hours=24)):
@@ -251,14 +396,171 @@ class ProviderResponse(models.Model):
         if self.volume is not None:
             serialized_data['volume'] = float('{:.8f}'.format(self.volume))
 
-        if self.providerresponse_set.all().count() > 0:
+        if combined_responses:
             serialized_data['combined_responses'] = [
-                resp.serialize() for resp in self.providerresponse_set.all()
+                resp.serialize(moving_averages) for resp in combined_responses
             ]
 
         return serialized_data
 
 
+class ProviderCoverageManager(models.Manager):
+    def record(self, responses):
+        """
+        Mark the provider and currency of each newly saved response as seen and point them at their latest response.
+        New pairs are added with a single insert and the rest are moved on with a single update.
+        Where the responses came from a bulk insert without primary keys the latest responses are looked up again
+        """
+        latest_responses = {}
+
+        for response in responses:
+            pair = (response.provider_id, response.currency_id)
+
+            if pair not in latest_responses or response.date_time > latest_responses[pair].date_time:
+                latest_responses[pair] = response
+
+        if not latest_responses:
+            return
+
+        self.bulk_create(
+            [
+                ProviderCoverage(
+                    provider_id=provider_id,
+                    currency_id=currency_id,
+                    last_seen=response.date_time,
+                    latest_response=response
+                ) for (provider_id, currency_id), response in latest_responses.items()
+            ],
+            ignore_conflicts=True
+        )
+
+        # existing pairs are only moved on if the response is newer than the one they have
+        newer = {
+            pair: Q(
+                provider_id=pair[0],
+                currency_id=pair[1],
+                last_seen__lt=response.date_time
+            ) for pair, response in latest_responses.items()
+        }
+        newer_filter = Q()
+
+        for condition in newer.values():
+            newer_filter |= condition
+
+        # bulk inserts only give the responses primary keys on backends that can return the new rows
+        has_pks = all(response.pk is not None for response in latest_responses.values())
+        updates = {
+            'last_seen': Case(
+                *[When(condition, then=Value(latest_responses[pair].date_time)) for pair, condition in newer.items()],
+                output_field=models.DateTimeField()
+            )
+        }
+
+        if has_pks:
+            updates['latest_response'] = Case(
+                *[When(condition, then=Value(latest_responses[pair].pk)) for pair, condition in newer.items()],
+                output_field=models.IntegerField()
+            )
+
+        self.filter(
+            newer_filter
+        ).update(
+            **updates
+        )
+
+        if has_pks:
+            return
+
+        # otherwise the latest responses of the pairs are looked up again
+        pair_filter = Q()
+
+        for provider_id, currency_id in latest_responses:
+            pair_filter |= Q(provider_id=provider_id, currency_id=currency_id)
+
+        self.filter(
+            pair_filter
+        ).update(
+            latest_response=Subquery(
+                ProviderResponse.objects.filter(
+                    provider=OuterRef('provider'),
+                    currency=OuterRef('currency')
+                ).order_by(
+                    '-date_time',
+                    '-pk'
+                ).values(
+                    'pk'
+                )[:1]
+            )
+        )
+
+    def latest_response(self, provider, currency):
+        """
+        Get the latest response from the provider for the currency.
+        Returns None if the provider has never given a response for the currency
+        """
+        try:
+            coverage = self.select_related(
+                'latest_response__provider',
+                'latest_response__currency'
+            ).get(
+                provider=provider,
+                currency=currency
+            )
+        except ProviderCoverage.DoesNotExist:
+            return None
+
+        if coverage.latest_response is not None:
+            return coverage.latest_response
+
+        # the latest response has been removed so fall back to the responses that are left
+        return provider.providerresponse_set.filter(currency=currency).order_by('date_time').last()
+
+    def current(self, days=1):
+        """
+        Get the provider and currency pairs that have had a response in the last number of days
+        """
+        return self.filter(
+            last_seen__gte=now() - datetime.timedelta(days=days)
+        )
+
+
+class ProviderCoverage(models.Model):
+    """
+    One row per provider and currency pair that has ever had a response, with the latest response and its time.
+    Kept up to date as responses are saved so coverage can be read without scanning ProviderResponse
+    """
+    provider = models.ForeignKey(
+        Provider,
+        on_delete=models.CASCADE
+    )
+    currency = models.ForeignKey(
+        Currency,
+        on_delete=models.CASCADE
+    )
+    last_seen = models.DateTimeField(
+        db_index=True
+    )
+    latest_response = models.ForeignKey(
+        'ProviderResponse',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='+'
+    )
+
+    objects = ProviderCoverageManager()
+
+    def __str__(self):
+        return '{} {} ({})'.format(
+            self.provider,
+            self.currency,
+            self.last_seen
+        )
+
+    class Meta:
+        unique_together = ['provider', 'currency']
+
+
 class ProviderFailure(models.Model):
     date_time = models.DateTimeField(
         auto_now_add=True
@@ -273,41 +575,185 @@ class ProviderFailure(models.Model):
     )
 
 
-class AggregatedPriceManager(models.Manager):
-    def get_closest_to(self, currency, target):
-        closest_greater_qs = self.filter(
-            currency=currency,
-            date_time__gt=target
+class AggregatedPriceManager(ClosestToManager):
+    # the moving averages kept for each aggregated price, in minutes
+    MOVING_AVERAGE_PERIODS = {
+        '24_hour': 1440,
+        '12_hour': 720,
+        '6_hour': 360,
+        '1_hour': 60,
+        '30_minute': 30
+    }
+
+    def calculate_moving_averages(self, new_prices, date_time):
+        """
+        Calculate the moving averages for new aggregated prices about to be saved at date_time.
+        new_prices maps currency pk to the new aggregated price.
+        The running sums and counts of each window are fetched for all currencies in one query
+        and the new price is added to them.
+        Returns the moving averages keyed by currency pk
+        """
+        window_totals = {}
+
+        for period, minutes in self.MOVING_AVERAGE_PERIODS.items():
+            period_filter = Q(date_time__gte=date_time - datetime.timedelta(minutes=minutes))
+            window_totals['{}_sum'.format(period)] = Sum('aggregated_price', filter=period_filter)
+            window_totals['{}_count'.format(period)] = Count('pk', filter=period_filter)
+
+        windows = {
+            window['currency']: window for window in self.filter(
+                currency__in=list(new_prices.keys()),
+                date_time__gt=date_time - datetime.timedelta(hours=24)
+            ).order_by().values(
+                'currency'
+            ).annotate(
+                **window_totals
+            )
+        }
+
+        moving_averages = {}
+
+        for currency_pk, new_price in new_prices.items():
+            window = windows.get(currency_pk, {})
+            moving_averages[currency_pk] = {}
+
+            for period in self.MOVING_AVERAGE_PERIODS:
+                count = window.get('{}_count'.format(period), 0) + 1
+
+                if count < 2:
+                    continue
+
+                avg = (float(window['{}_sum'.format(period)]) + float(new_price)) / count
+
+                if not math.isnan(avg):
+                    moving_averages[currency_pk][period] = float('{:.8f}'.format(avg))
+
+        return moving_averages
+
+    def latest_per_currency(self):
+        """
+        Get the most recent aggregated price for each currency in a single query.
+        Each currency's latest price is a LIMIT 1 probe of the (currency, date_time) index
+        so older prices are never read
+        """
+        return self.filter(
+            pk__in=Currency.objects.annotate(
+                latest_price=Subquery(
+                    self.model.objects.filter(
+                        currency=OuterRef('pk')
+                    ).order_by(
+                        '-date_time'
+                    ).values(
+                        'pk'
+                    )[:1]
+                )
+            ).values(
+                'latest_price'
+            )
         ).order_by(
-            'date_time'
+            'currency'
         )
 
-        closest_less_qs = self.filter(
+    def history(self, currency, start, end, interval):
+        """
+        Group the aggregated prices between start and end into buckets of interval seconds.
+        Returns an iterator of (bucket timestamp, open, high, low, close, mean, samples) rows in time order.
+        PostgreSQL groups them in a single query.
+        Other databases can't take the first value of a group so the prices are grouped as they are read
+        """
+        agg_prices = self.filter(
             currency=currency,
-            date_time__lt=target
-        ).order_by(
-            '-date_time'
+            date_time__gte=start,
+            date_time__lt=end
         )
 
-        try:
-            try:
-                closest_greater = closest_greater_qs[0]
-            except IndexError:
-                return closest_less_qs[0]
-
-            try:
-                closest_less = closest_less_qs[0]
-            except IndexError:
-                return closest_greater_qs[0]
-        except IndexError:
-            raise self.model.DoesNotExist(
-                "There is no closest value because there are no values."
+        if connections[self.db].vendor != 'postgresql':
+            return self.bucket_prices(
+                agg_prices.order_by('date_time').values_list('date_time', 'aggregated_price').iterator(),
+                interval
             )
 
-        if closest_greater.date_time - target > target - closest_less.date_time:
-            return closest_less
-        else:
-            return closest_greater
+        return agg_prices.annotate(
+            bucket=EpochBucket('date_time', interval)
+        ).order_by(
+            'bucket'
+        ).values(
+            'bucket'
+        ).annotate(
+            open=FirstValue('aggregated_price', F('date_time').asc(), output_field=models.DecimalField()),
+            high=Max('aggregated_price'),
+            low=Min('aggregated_price'),
+            close=FirstValue('aggregated_price', F('date_time').desc(), output_field=models.DecimalField()),
+            mean=Avg('aggregated_price'),
+            samples=Count('pk')
+        ).values_list(
+            'bucket',
+            'open',
+            'high',
+            'low',
+            'close',
+            'mean',
+            'samples'
+        ).iterator()
+
+    @staticmethod
+    def bucket_prices(prices, interval):
+        """
+        Group (date_time, aggregated_price) rows, in time order, into the same rows history gives
+        """
+        for bucket, rows in groupby(prices, key=lambda row: int(row[0].timestamp()) // interval * interval):
+            values = [value for date_time, value in rows]
+            yield bucket, values[0], max(values), min(values), values[-1], sum(values) / len(values), len(values)
+
+    def add_used_responses(self, used_responses):
+        """
+        Link the used responses to many aggregated prices with a single insert into the through table.
+        used_responses is an iterable of (aggregated_price, response pks) pairs
+        """
+        through = self.model.used_responses.through
+
+        through.objects.bulk_create(
+            [
+                through(
+                    aggregatedprice_id=aggregated_price.pk,
+                    providerresponse_id=response_pk
+                ) for aggregated_price, response_pks in used_responses for response_pk in response_pks
+            ]
+        )
+
+    def used_responses_of(self, agg_prices):
+        """
+        Get the serializable used responses of many aggregated prices, and the moving averages they show,
+        in a fixed number of queries.
+        Returns (lists of used responses keyed by aggregated price pk, moving averages keyed by response pk)
+        """
+        used_responses = {agg_price.pk: [] for agg_price in agg_prices}
+
+        for response in ProviderResponse.objects.serializable().filter(
+            aggregatedprice__in=list(used_responses)
+        ).annotate(
+            aggregated_price_pk=F('aggregatedprice')
+        ):
+            used_responses[response.aggregated_price_pk].append(response)
+
+        # the moving averages of all the used responses and the responses they combine are found at once
+        moving_averages = ProviderResponse.objects.calculate_moving_averages(
+            [
+                response for responses in used_responses.values() for used_response in responses
+                for response in [used_response] + list(used_response.providerresponse_set.all())
+            ]
+        )
+
+        return used_responses, moving_averages
+
+    def get_closest_to(self, currency, target):
+        return self.get_closest_to_many(currency, [target])[0]
+
+    def get_closest_to_many(self, currency, targets):
+        """
+        Get the aggregated price closest to each of the targets with a single query
+        """
+        return self.closest_to_many(targets, currency=currency)
 
 
 class AggregatedPrice(models.Model):
@@ -315,20 +761,20 @@ class AggregatedPrice(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    # currency lookups are served by the composite index in Meta
     currency = models.ForeignKey(
         Currency,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False
     )
     aggregated_price = models.DecimalField(
         decimal_places=10,
-        max_digits=25,
-        db_index=True
+        max_digits=25
     )
     providers = models.DecimalField(
         decimal_places=10,
         max_digits=25,
-        default=0,
-        db_index=True
+        default=0
     )
     standard_deviation = models.DecimalField(
         decimal_places=10,
@@ -343,11 +789,19 @@ class AggregatedPrice(models.Model):
     used_responses = models.ManyToManyField(
         ProviderResponse
     )
+    moving_averages = models.JSONField(
+        blank=True,
+        null=True,
+        help_text='The moving averages as they were when this price was aggregated'
+    )
 
     objects = AggregatedPriceManager()
 
     class Meta:
         ordering = ['-date_time']
+        indexes = [
+            models.Index(fields=['currency', 'date_time'])
+        ]
 
     def calculate_moving_averages(self):
         """
@@ -390,10 +844,16 @@ class AggregatedPrice(models.Model):
 
         return moving_averages
 
-    def serialize(self, style):
+    def serialize(self, style, used_responses=None, moving_averages=None):
+        """
+        The full style can be given the used responses of this price and their moving averages,
+        as returned by AggregatedPrice.objects.used_responses_of. Otherwise they are fetched for this price
+        """
         serialized_data = {
             'currency': self.currency.code,
-            'moving_averages': self.calculate_moving_averages(),
+            'moving_averages': (
+                self.moving_averages if self.moving_averages is not None else self.calculate_moving_averages()
+            ),
             'currency_name': self.currency.name,
             'aggregation_date_time': self.date_time,
             'aggregated_usd_price': float('{:.8f}'.format(self.aggregated_price)),
@@ -403,8 +863,12 @@ class AggregatedPrice(models.Model):
         }
 
         if style == 'full':
+            if used_responses is None:
+                used_responses, moving_averages = AggregatedPrice.objects.used_responses_of([self])
+                used_responses = used_responses[self.pk]
+
             serialized_data['prices_used'] = [
-                resp.serialize() for resp in self.used_responses.all()
+                resp.serialize(moving_averages) for resp in used_responses
             ]
 
         if self.date_time < (now() - datetime.timedelta(hours=24)):
@@ -479,3 +943,14 @@ class ArbitrageOpportunity(models.Model):
         ordering = ['-date_time']
 
 
+# changes whenever a Provider or ProviderBlackList is saved or deleted so the ResponseSink knows to reload them
+RESPONSE_SINK_VERSION_KEY = 'response_sink_version'
+
+
+@receiver([post_save, post_delete], sender=Provider)
+@receiver([post_save, post_delete], sender=ProviderBlackList)
+def provider_lookups_changed(**kwargs):
+    """
+    Tell every ResponseSink that its cached providers and blacklist are out of date
+    """
+    caches[settings.RESPONSE_SINK_CACHE].set(RESPONSE_SINK_VERSION_KEY, uuid.uuid4().hex, None)
@@ -0,0 +1,94 @@
+from django.contrib.postgres import operations
+from django.db.migrations import AddIndex, AlterField
+from django.db.models import Index
+
+
+def is_postgresql(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+def is_partitioned(schema_editor, model):
+    """
+    Whether the model's table is a partitioned table, which can't have indexes built or dropped concurrently
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+            [model._meta.db_table]
+        )
+        return cursor.fetchone()[0]
+
+
+def can_index_concurrently(schema_editor, app_label, model_name, state):
+    return is_postgresql(schema_editor) and not is_partitioned(
+        schema_editor,
+        state.apps.get_model(app_label, model_name)
+    )
+
+
+class AddIndexConcurrently(operations.AddIndexConcurrently):
+    """
+    Build the index with CREATE INDEX CONCURRENTLY on PostgreSQL so the table can still be written to.
+    Partitioned tables and other databases build it normally
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if can_index_concurrently(schema_editor, app_label, self.model_name, to_state):
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if can_index_concurrently(schema_editor, app_label, self.model_name, from_state):
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class AlterFieldIndexConcurrently(operations.NotInTransactionMixin, AlterField):
+    """
+    Add or drop the single column index of a field whose db_index has changed,
+    using CREATE INDEX CONCURRENTLY and DROP INDEX CONCURRENTLY on PostgreSQL.
+    Nothing else about the field may change. Partitioned tables have the index built or dropped normally
+    and other databases alter the field normally.
+    Reversing runs the same steps with the states swapped
+    """
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+        self._ensure_not_in_transaction(schema_editor)
+        to_model = to_state.apps.get_model(app_label, self.model_name)
+
+        if self.allow_migrate_model(schema_editor.connection.alias, to_model):
+            from_model = from_state.apps.get_model(app_label, self.model_name)
+            self.alter_index(
+                schema_editor,
+                to_model,
+                from_model._meta.get_field(self.name),
+                to_model._meta.get_field(self.name),
+                # the model's own indexes can cover the same column so are left alone
+                {index.name for index in from_model._meta.indexes + to_model._meta.indexes},
+                not is_partitioned(schema_editor, to_model)
+            )
+
+    @staticmethod
+    def alter_index(schema_editor, model, old_field, new_field, model_index_names, concurrently):
+        if old_field.db_index and not new_field.db_index:
+            index_names = schema_editor._constraint_names(
+                model,
+                [old_field.column],
+                index=True,
+                type_=Index.suffix,
+                exclude=model_index_names
+            )
+
+            for index_name in index_names:
+                schema_editor.execute(schema_editor._delete_index_sql(model, index_name, concurrently=concurrently))
+
+        if new_field.db_index and not old_field.db_index:
+            schema_editor.execute(schema_editor._create_index_sql(model, [new_field], concurrently=concurrently))
+
+    def describe(self):
+        return 'Concurrently alter the index of field {} on {}'.format(self.name, self.model_name)
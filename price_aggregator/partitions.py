@@ -0,0 +1,376 @@
+import datetime
+import logging
+import re
+
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from price_aggregator import retention
+from price_aggregator.retention import quote
+from price_aggregator.models import ProviderResponse
+
+logger = logging.getLogger(__name__)
+
+# the sizes a ProviderResponse partition can be
+PARTITION_INTERVALS = ('day', 'week')
+
+
+def table_name():
+    return ProviderResponse._meta.db_table
+
+
+def is_partitioned():
+    """
+    Whether the ProviderResponse table has been converted to a table partitioned by date_time
+    """
+    if connection.vendor != 'postgresql':
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+            [table_name()]
+        )
+        return cursor.fetchone()[0]
+
+
+def period_start(date_time, interval):
+    """
+    The start of the partition that date_time falls in.
+    Daily partitions start at midnight UTC and weekly ones at midnight UTC on Monday
+    """
+    start = date_time.astimezone(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if interval == 'week':
+        start -= datetime.timedelta(days=start.weekday())
+
+    return start
+
+
+def period_end(start, interval):
+    return start + datetime.timedelta(days=7 if interval == 'week' else 1)
+
+
+def partition_name(start):
+    return '{}_p{}'.format(table_name(), start.strftime('%Y%m%d'))
+
+
+def get_partitions():
+    """
+    Get the (name, upper bound) of each partition in order of their ranges.
+    The upper bound of the default partition is None
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) '
+            'FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = to_regclass(%s)',
+            [table_name()]
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+
+    for name, bound in rows:
+        upper = re.search(r"TO \('([^']+)'\)", bound)
+        partitions.append((name, parse_datetime(upper.group(1)) if upper else None))
+
+    # the default partition goes last
+    return sorted(partitions, key=lambda partition: (partition[1] is None, partition[1]))
+
+
+def has_unapplied_migrations():
+    """
+    Whether the database is behind the migrations.
+    The table is only converted or reverted when it matches the migrations, as the migration state is what
+    the reverted table is rebuilt from and migrations that alter ProviderResponse can't run once it's partitioned
+    """
+    executor = MigrationExecutor(connection)
+    return bool(executor.migration_plan(executor.loader.graph.leaf_nodes()))
+
+
+def convert(interval):
+    """
+    Turn the ProviderResponse table into a table partitioned by date_time.
+    The existing table is attached as the first partition, covering everything up to the end of the next period,
+    so none of its rows are copied. A default partition catches any rows outside the created partitions.
+
+    The (id, date_time) index the new primary key needs and a check constraint that lets postgres attach
+    the old table without scanning it are built first while responses can still be written.
+    Swapping the tables then only holds the lock for as long as it takes to change the catalog.
+
+    Partitioned tables can only be referenced by foreign keys that include date_time so the foreign keys
+    that point at ProviderResponse are dropped. Django still cascades deletes made through the ORM
+    and retention deletes what depends on the responses it removes.
+    The migrations that add or drop indexes on ProviderResponse still work but any other migration that
+    alters its fields or the fields pointing at it needs the table reverted first
+    """
+    table = table_name()
+    legacy = '{}_legacy'.format(table)
+    unique_index = '{}_id_date_time_uniq'.format(table)
+    check = '{}_date_time_check'.format(legacy)
+    # a whole period is left for the conversion to finish before the check constraint turns new responses away
+    boundary = period_end(period_end(period_start(now(), interval), interval), interval)
+
+    with connection.cursor() as cursor:
+        # an earlier run that failed part way through may have left an invalid index behind
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(quote(unique_index)))
+        cursor.execute('CREATE UNIQUE INDEX CONCURRENTLY {} ON {} (id, date_time)'.format(
+            quote(unique_index),
+            quote(table)
+        ))
+        cursor.execute('ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}'.format(quote(table), quote(check)))
+        cursor.execute(
+            'ALTER TABLE {} ADD CONSTRAINT {} CHECK (date_time < %s) NOT VALID'.format(quote(table), quote(check)),
+            [boundary]
+        )
+        cursor.execute('ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(quote(table), quote(check)))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = %s::regclass",
+            [table]
+        )
+
+        for referencing_table, constraint in cursor.fetchall():
+            logger.info('Dropping foreign key {} on {}'.format(constraint, referencing_table))
+            cursor.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(referencing_table, quote(constraint)))
+
+        # the indexes and foreign keys are recreated on the partitioned table with the same definitions,
+        # which lets postgres adopt the existing ones on the old table rather than building them again
+        cursor.execute(
+            'SELECT indexname, indexdef FROM pg_indexes '
+            'WHERE schemaname = current_schema() AND tablename = %s AND indexname NOT IN (%s, %s)',
+            [table, '{}_pkey'.format(table), unique_index]
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE contype = 'f' AND conrelid = %s::regclass",
+            [table]
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, 'id'])
+        sequence = cursor.fetchone()[0]
+
+        # the primary key of a partitioned table has to include date_time.
+        # The old table's key is swapped for one on the (id, date_time) index, which the partitioned table's adopts
+        cursor.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(quote(table), quote('{}_pkey'.format(table))))
+        cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY USING INDEX {}'.format(
+            quote(table),
+            quote('{}_pkey'.format(legacy)),
+            quote(unique_index)
+        ))
+        cursor.execute('ALTER TABLE {} RENAME TO {}'.format(quote(table), quote(legacy)))
+
+        for index_name, index_definition in indexes:
+            cursor.execute(
+                'ALTER INDEX {} RENAME TO {}'.format(quote(index_name), quote('{}_legacy'.format(index_name)))
+            )
+
+        cursor.execute(
+            'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) PARTITION BY RANGE (date_time)'.format(
+                quote(table),
+                quote(legacy)
+            )
+        )
+        # the id sequence moves to the new table so it isn't dropped along with the old one
+        cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(sequence, quote(table)))
+        cursor.execute(
+            'ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (MINVALUE) TO (%s)'.format(
+                quote(table),
+                quote(legacy)
+            ),
+            [boundary]
+        )
+        # the partition bound does the check constraint's job from here on
+        cursor.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(quote(legacy), quote(check)))
+        cursor.execute(
+            'ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY (id, date_time)'.format(
+                quote(table),
+                quote('{}_pkey'.format(table))
+            )
+        )
+
+        for index_name, index_definition in indexes:
+            cursor.execute(index_definition)
+
+        for constraint, constraint_definition in foreign_keys:
+            cursor.execute(
+                'ALTER TABLE {} ADD CONSTRAINT {} {}'.format(quote(table), quote(constraint), constraint_definition)
+            )
+
+        cursor.execute(
+            'CREATE TABLE {} PARTITION OF {} DEFAULT'.format(quote('{}_default'.format(table)), quote(table))
+        )
+
+    logger.info('{} is now partitioned by {}. Existing responses are in {}'.format(table, interval, legacy))
+
+
+def revert():
+    """
+    Turn the partitioned ProviderResponse table back into a plain table with the schema the migrations give it,
+    restoring the foreign keys that point at it.
+    Every response is copied across and the responses can't be read or written until that's done.
+    Nothing is changed if a row points at a response that no longer exists, as its foreign key can't be added
+    """
+    table = table_name()
+    partitioned = '{}_partitioned'.format(table)
+    state_apps = MigrationLoader(connection).project_state().apps
+    model = state_apps.get_model(ProviderResponse._meta.app_label, ProviderResponse._meta.model_name)
+    columns = ', '.join(quote(field.column) for field in model._meta.local_concrete_fields)
+
+    with connection.schema_editor() as schema_editor, connection.cursor() as cursor:
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, 'id'])
+        sequence = cursor.fetchone()[0]
+        cursor.execute('SELECT last_value, is_called FROM {}'.format(sequence))
+        last_value, is_called = cursor.fetchone()
+
+        # the partitioned table's indexes and sequence are dropped so their names are free for the new table
+        cursor.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(quote(table), quote('{}_pkey'.format(table))))
+        cursor.execute(
+            'SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s',
+            [table]
+        )
+
+        for index_name, in cursor.fetchall():
+            cursor.execute('DROP INDEX {}'.format(quote(index_name)))
+
+        cursor.execute('ALTER TABLE {} ALTER COLUMN id DROP DEFAULT'.format(quote(table)))
+        cursor.execute('DROP SEQUENCE {}'.format(sequence))
+        cursor.execute('ALTER TABLE {} RENAME TO {}'.format(quote(table), quote(partitioned)))
+
+        # the indexes and foreign keys are deferred until the responses have been copied
+        schema_editor.create_model(model)
+        cursor.execute('INSERT INTO {} ({columns}) SELECT {columns} FROM {}'.format(
+            quote(table),
+            quote(partitioned),
+            columns=columns
+        ))
+        logger.info('Copied {} responses'.format(cursor.rowcount))
+        cursor.execute(
+            'SELECT setval(pg_get_serial_sequence(%s, %s), %s, %s)',
+            [table, 'id', last_value, is_called]
+        )
+        cursor.execute('DROP TABLE {}'.format(quote(partitioned)))
+
+        for related_model in state_apps.get_models(include_auto_created=True):
+            if related_model is model:
+                continue
+
+            for field in related_model._meta.local_fields:
+                if field.remote_field and field.remote_field.model is model and field.db_constraint:
+                    schema_editor.deferred_sql.append(
+                        schema_editor._create_fk_sql(related_model, field, '_fk_%(to_table)s_%(to_column)s')
+                    )
+
+    logger.info('{} is no longer partitioned'.format(table))
+
+
+def create_partitions(interval, ahead):
+    """
+    Make sure there are partitions for the current period and the given number of periods after it.
+    Returns the names of the partitions that were created
+    """
+    covered_until = max((upper for name, upper in get_partitions() if upper is not None), default=None)
+    start = period_start(now(), interval)
+    created = []
+
+    for _ in range(ahead + 1):
+        end = period_end(start, interval)
+
+        if covered_until is None or start >= covered_until:
+            create_partition(start, end)
+            created.append(partition_name(start))
+
+        start = end
+
+    return created
+
+
+def create_partition(start, end):
+    """
+    Create the partition for responses from start up to end.
+    Postgres won't create a partition while the default partition holds rows in its range,
+    which happens when the periodic task hasn't run for a while.
+    Those rows are moved into the new partition with the default partition detached
+    """
+    table = table_name()
+    default = '{}_default'.format(table)
+    name = partition_name(start)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM {} WHERE date_time >= %s AND date_time < %s)'.format(quote(default)),
+            [start, end]
+        )
+
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(
+                    quote(name),
+                    quote(table)
+                ),
+                [start, end]
+            )
+            logger.info('Created partition {} for {} to {}'.format(name, start, end))
+            return
+
+        logger.warning(
+            'The default partition has responses from {} to {}. Moving them to {}'.format(start, end, name)
+        )
+
+        # the responses can't be written while this runs
+        cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(quote(table), quote(default)))
+        cursor.execute(
+            'CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(quote(name), quote(table)),
+            [start, end]
+        )
+        cursor.execute(
+            'INSERT INTO {} SELECT * FROM {} WHERE date_time >= %s AND date_time < %s'.format(
+                quote(name),
+                quote(default)
+            ),
+            [start, end]
+        )
+        moved = cursor.rowcount
+        cursor.execute(
+            'DELETE FROM {} WHERE date_time >= %s AND date_time < %s'.format(quote(default)),
+            [start, end]
+        )
+        cursor.execute('ALTER TABLE {} ATTACH PARTITION {} DEFAULT'.format(quote(table), quote(default)))
+
+    logger.info(
+        'Created partition {} for {} to {} with {} responses moved from the default partition'.format(
+            name,
+            start,
+            end,
+            moved
+        )
+    )
+
+
+def drop_partitions(before):
+    """
+    Drop every partition that only holds responses from before the given time.
+    There are no foreign keys to cascade so the rows pointing at the dropped responses are dealt with first.
+    Returns the names of the partitions that were dropped
+    """
+    dropped = []
+
+    for name, upper in get_partitions():
+        if upper is None or upper > before:
+            continue
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            retention.delete_response_dependents(cursor, 'SELECT id FROM {}'.format(quote(name)), [])
+            cursor.execute('DROP TABLE {}'.format(quote(name)))
+
+        logger.info('Dropped partition {} of responses before {}'.format(name, upper))
+        dropped.append(name)
+
+    return dropped
@@ -0,0 +1,171 @@
+import logging
+import math
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from django.utils.timezone import now
+
+from price_aggregator.models import RESPONSE_SINK_VERSION_KEY, Provider, ProviderBlackList, ProviderCoverage, \
+    ProviderResponse
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseSink(object):
+    """
+    Persist normalized price data as ProviderResponses in bulk.
+
+    Each price is a dict with the keys 'coin' (a Currency), 'price' and optionally
+    'provider' (the name of a market_provider), 'market_price' and 'volume'.
+    Providers and blacklist entries are cached in process and refreshed once the cache ttl has passed
+    or a Provider or ProviderBlackList has been saved or deleted
+    """
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else settings.RESPONSE_SINK_CACHE_TTL
+        self.providers = {}
+        self.blacklist = set()
+        self.loaded_at = None
+        self.version = None
+
+    def invalidate(self):
+        self.providers = {}
+        self.blacklist = set()
+        self.loaded_at = None
+
+    def refresh(self):
+        """
+        Drop the cached lookups if they have expired or been changed and reload the blacklist
+        """
+        version = caches[settings.RESPONSE_SINK_CACHE].get(RESPONSE_SINK_VERSION_KEY)
+
+        if (
+            self.loaded_at is not None
+            and version == self.version
+            and time.monotonic() - self.loaded_at < self.ttl
+        ):
+            return
+
+        self.invalidate()
+        self.blacklist = set(ProviderBlackList.objects.values_list('provider_id', 'currency_id'))
+        self.loaded_at = time.monotonic()
+        self.version = version
+
+    def get_providers(self, names, exchange_provider=False, cache=300):
+        """
+        Return a dict of Providers keyed by lower case name.
+        Uncached providers are fetched in a single query and any that don't exist are created
+        """
+        names = {name.lower(): name for name in names}
+        missing = [lower_name for lower_name in names if lower_name not in self.providers]
+
+        if missing:
+            self.providers.update(self.fetch_providers(missing))
+
+            for lower_name in missing:
+                if lower_name not in self.providers:
+                    self.providers[lower_name] = self.create_provider(names[lower_name], exchange_provider, cache)
+
+        return {lower_name: self.providers[lower_name] for lower_name in names}
+
+    @staticmethod
+    def create_provider(name, exchange_provider, cache):
+        """
+        Get or create the named provider. New providers are rare so they are created one at a time
+        """
+        defaults = {
+            'name': name,
+            'exchange_provider': exchange_provider,
+            'cache': cache
+        }
+
+        try:
+            return Provider.objects.get_or_create(name__iexact=name, defaults=defaults)[0]
+        except IntegrityError:
+            # another process created the provider between the lookup and the insert
+            return Provider.objects.get(name__iexact=name)
+
+    @staticmethod
+    def fetch_providers(lower_names):
+        return {
+            provider.lower_name: provider for provider in Provider.objects.annotate(
+                lower_name=Lower('name')
+            ).filter(
+                lower_name__in=lower_names
+            )
+        }
+
+    def save(self, prices, provider_name=None, exchange_provider=False, cache=300):
+        """
+        Save the prices in a single transaction.
+        provider_name is used for any price that doesn't name its own market_provider.
+        New market_providers are created with the given exchange_provider and cache values
+        """
+        self.refresh()
+
+        # prices that aren't numbers are dropped rather than failing the whole batch
+        values = [(price, to_price_value(price['price'])) for price in prices]
+        prices = [dict(price, price=value) for price, value in values if value is not None]
+
+        if not prices:
+            return []
+
+        try:
+            with transaction.atomic():
+                return self.save_responses(prices, provider_name, exchange_provider, cache)
+        except Exception:
+            # providers created in a rolled back transaction mustn't stay cached
+            self.invalidate()
+            raise
+
+    def save_responses(self, prices, provider_name, exchange_provider, cache):
+        price_providers = self.get_providers(
+            {price.get('provider', provider_name) for price in prices},
+            exchange_provider=exchange_provider,
+            cache=cache
+        )
+
+        responses = []
+
+        for price in prices:
+            price_provider = price_providers[price.get('provider', provider_name).lower()]
+
+            # if the provider is blacklisted, we skip.
+            # We perform this check here otherwise market_providers cannot be individually blacklisted
+            if (price_provider.pk, price['coin'].pk) in self.blacklist:
+                continue
+
+            logger.info('Saving {} from {}: {:.8f}'.format(price['coin'], price_provider.name, price['price']))
+
+            responses.append(
+                ProviderResponse(
+                    provider=price_provider,
+                    currency=price['coin'],
+                    value=price['price'],
+                    market_value=price.get('market_price', 0),
+                    volume=price.get('volume'),
+                    update_by=now() + timedelta(seconds=price_provider.cache)
+                )
+            )
+
+        responses = ProviderResponse.objects.bulk_create(responses)
+        ProviderCoverage.objects.record(responses)
+        return responses
+
+
+def to_price_value(value):
+    """
+    Return the price as a float, or None if it isn't a number
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return None if math.isnan(value) else value
+
+
+response_sink = ResponseSink()
@@ -0,0 +1,60 @@
+from django.db import connection
+
+from price_aggregator.models import AggregatedPrice, ArbitrageOpportunity, ProviderCoverage, ProviderResponse
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+def delete_response_dependents(cursor, responses, params):
+    """
+    Deal with everything that depends on the responses picked by the responses query (a SELECT of their ids)
+    the way the ORM's on_delete rules would, as the database doesn't cascade the foreign keys itself.
+    Responses combined into them are deleted along with anything that depends on those,
+    their used_responses links and arbitrage opportunities are deleted and coverage rows stop pointing at them.
+    The responses themselves are left for the caller to delete or drop.
+    Returns the number of combined responses deleted
+    """
+    table = quote(ProviderResponse._meta.db_table)
+    through = AggregatedPrice.used_responses.through
+
+    # the responses and every response combined into them, however deeply
+    doomed = (
+        'WITH RECURSIVE doomed (id) AS ('
+        '{responses} UNION SELECT child.id FROM {table} child JOIN doomed ON child.{parent} = doomed.id'
+        ') '
+    ).format(
+        responses=responses,
+        table=table,
+        parent=quote(ProviderResponse._meta.get_field('parent_response').column)
+    )
+
+    cursor.execute(
+        doomed + 'DELETE FROM {} WHERE {} IN (SELECT id FROM doomed)'.format(
+            quote(through._meta.db_table),
+            quote(through._meta.get_field('providerresponse').column)
+        ),
+        params
+    )
+    cursor.execute(
+        doomed + 'DELETE FROM {} WHERE {} IN (SELECT id FROM doomed) OR {} IN (SELECT id FROM doomed)'.format(
+            quote(ArbitrageOpportunity._meta.db_table),
+            quote(ArbitrageOpportunity._meta.get_field('low_provider_response').column),
+            quote(ArbitrageOpportunity._meta.get_field('high_provider_response').column)
+        ),
+        params
+    )
+    cursor.execute(
+        doomed + 'UPDATE {} SET {column} = NULL WHERE {column} IN (SELECT id FROM doomed)'.format(
+            quote(ProviderCoverage._meta.db_table),
+            column=quote(ProviderCoverage._meta.get_field('latest_response').column)
+        ),
+        params
+    )
+    cursor.execute(
+        doomed + 'DELETE FROM {} WHERE id IN (SELECT id FROM doomed EXCEPT {})'.format(table, responses),
+        params * 2
+    )
+
+    return cursor.rowcount
@@ -1,5 +1,12 @@
-from channels.routing import ProtocolTypeRouter
+from channels.routing import ProtocolTypeRouter, URLRouter
+from django.core.asgi import get_asgi_application
+from django.urls import path
+
+from price_aggregator.consumers import PriceConsumer
 
 application = ProtocolTypeRouter({
-    # Empty for now (http->django views is added by default)
+    'http': get_asgi_application(),
+    'websocket': URLRouter([
+        path('ws/prices', PriceConsumer.as_asgi()),
+    ]),
 })
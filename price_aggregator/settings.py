@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'channels',
     'storages',
     'price_aggregator',
     'django_celery_beat',
@@ -165,11 +166,56 @@ CELERY_TASK_ROUTES = {
     'celery.*': {'queue': 'celery'},
     'price_aggregator.tasks.periodic_tasks.*': {'queue': 'periodic_tasks'},
     'price_aggregator.tasks.calculate_aggregate.calculate_aggregate': {'queue': 'aggregates'},
+    'price_aggregator.tasks.calculate_aggregate.calculate_all_aggregates': {'queue': 'aggregates'},
     'price_aggregator.tasks.calculate_arbitrage.calculate_arbitrage': {'queue': 'arbitrage'},
     'price_aggregator.tasks.get_provider_response.get_provider_response': {'queue': 'provider_responses'},
     'price_aggregator.tasks.get_ccxt_response.get_ccxt_response': {'queue': 'ccxt_responses'},
 }
 
+# how long (in seconds) the provider and blacklist lookups used when saving responses are cached for
+RESPONSE_SINK_CACHE_TTL = 300
+# the cache a version is kept in that is changed whenever a provider or blacklist entry is saved or deleted,
+# telling every process to reload its lookups. Like the price snapshots this needs to be a shared cache,
+# with a per-process cache other processes pick up the change once the ttl has passed
+RESPONSE_SINK_CACHE = 'default'
+
+# the most ticker requests that are made to a single exchange at once
+CCXT_MAX_CONCURRENT_REQUESTS = 8
+
+# how long (in seconds) ccxt market lists are kept before being fetched again
+CCXT_MARKET_REFRESH_INTERVAL = 3600
+
+# calculate the aggregates for all currencies in a single task rather than one task per currency
+CALCULATE_AGGREGATES_IN_BATCH = True
+
+# the cache the rendered latest prices are stored in.
+# This needs to be a cache shared by the workers and web processes (memcached, redis etc)
+# for the snapshots to be used. With a per-process cache the price view falls back to the database
+PRICE_SNAPSHOT_CACHE = 'default'
+# a snapshot expires before the price is old enough to need a warning adding
+PRICE_SNAPSHOT_TIMEOUT = 60 * 60 * 23
+
+# new aggregated prices are pushed to websocket subscribers through the channel layer.
+# The in memory layer only reaches clients in the same process,
+# a shared layer (channels_redis) is needed for the celery workers to reach the ASGI server
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+    }
+}
+
+# the most points the history endpoint returns. Longer ranges get wider buckets
+HISTORY_MAX_POINTS = 1000
+
+# ProviderResponse can be stored in a table partitioned by date_time on PostgreSQL.
+# Set to 'day' or 'week' and run 'manage.py partition_responses --convert' once to turn it on.
+# 'manage.py partition_responses --revert' turns it back into a plain table
+PROVIDER_RESPONSE_PARTITION_INTERVAL = None
+# how many partitions are created ahead of the current one
+PROVIDER_RESPONSE_PARTITIONS_AHEAD = 7
+# responses are kept for this many days. Partitions are dropped once all of their responses are older
+PROVIDER_RESPONSE_RETENTION_DAYS = 30
+
 # Load local_settings
 try:
     from price_aggregator.local_settings import *  # noqa
@@ -0,0 +1,213 @@
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+
+from price_aggregator.consumers import price_group_name
+from price_aggregator.models import AggregatedPrice
+
+logger = logging.getLogger(__name__)
+
+# the serialization styles a snapshot is stored in when the price is saved.
+# The full style is only rendered once it is asked for as its moving averages are expensive to calculate
+PRICE_STYLES = ('short',)
+# the price movements are stored alongside the prices they lead up to
+MOVEMENT_STYLE = 'movement'
+
+
+def get_snapshot_cache():
+    return caches[settings.PRICE_SNAPSHOT_CACHE]
+
+
+def price_snapshot_key(currency_code, style):
+    return 'price_snapshot:{}:{}'.format(currency_code.lower(), style)
+
+
+def full_price_snapshot_key(currency_code, date_time):
+    # keyed by the price it renders so a new price never picks up the old rendering
+    return price_snapshot_key(currency_code, 'full:{}'.format(date_time.timestamp()))
+
+
+def render_price(agg_price, style, **kwargs):
+    """
+    Render the aggregated price as the JSON bytes the price endpoint sends.
+    Any kwargs are passed on to serialize
+    """
+    return json.dumps(agg_price.serialize(style, **kwargs), cls=DjangoJSONEncoder, sort_keys=True).encode()
+
+
+def render_full_prices(agg_prices):
+    """
+    Render the full style of many aggregated prices, fetching their used responses together.
+    Returns the renderings keyed by aggregated price pk
+    """
+    used_responses, moving_averages = AggregatedPrice.objects.used_responses_of(agg_prices)
+
+    return {
+        agg_price.pk: render_price(
+            agg_price,
+            'full',
+            used_responses=used_responses[agg_price.pk],
+            moving_averages=moving_averages
+        ) for agg_price in agg_prices
+    }
+
+
+def render_movements(agg_price):
+    """
+    Render the price movements up to the aggregated price as the JSON bytes the movement endpoint sends
+    """
+    return json.dumps(
+        agg_price.currency.currency_movements(agg_price),
+        cls=DjangoJSONEncoder,
+        sort_keys=True
+    ).encode()
+
+
+def store_price_snapshots(aggregated_prices):
+    """
+    Render newly saved aggregated prices, and the movements up to them,
+    and store them in the cache along with the date_time of the price.
+    Everything that saves aggregated prices calls this so a snapshot is always the latest price for its currency.
+    Each currency is stored on its own so a failure only affects that currency,
+    whose snapshots are removed so the views read the new price from the database instead
+    """
+    # the prices are read back so the snapshots show the values exactly as they were stored
+    stored_prices = AggregatedPrice.objects.select_related(
+        'currency'
+    ).filter(
+        pk__in=[agg_price.pk for agg_price in aggregated_prices]
+    )
+
+    published_prices = {}
+
+    for agg_price in stored_prices:
+        code = agg_price.currency.code
+
+        try:
+            snapshots = {style: render_price(agg_price, style) for style in PRICE_STYLES}
+            snapshots[MOVEMENT_STYLE] = render_movements(agg_price)
+
+            get_snapshot_cache().set_many(
+                {
+                    price_snapshot_key(code, style): (agg_price.date_time, content)
+                    for style, content in snapshots.items()
+                },
+                timeout=settings.PRICE_SNAPSHOT_TIMEOUT
+            )
+        except Exception:
+            logger.exception('Could not store the price snapshots for {}'.format(code))
+            delete_price_snapshots(code)
+            continue
+
+        published_prices[code] = snapshots['short'].decode()
+
+    # the same rendering is pushed to any streaming subscribers
+    publish_prices(published_prices)
+
+
+def delete_price_snapshots(currency_code):
+    """
+    Remove the stored snapshots of the currency so they can't be served in place of a newer price
+    """
+    try:
+        get_snapshot_cache().delete_many(
+            [price_snapshot_key(currency_code, style) for style in PRICE_STYLES + (MOVEMENT_STYLE,)]
+        )
+    except Exception:
+        logger.exception('Could not remove the price snapshots for {}'.format(currency_code))
+
+
+def publish_prices(prices):
+    """
+    Send rendered prices, keyed by currency code, to the clients subscribed to those currencies.
+    Streaming is best effort so a channel layer error is logged rather than raised
+    """
+    try:
+        channel_layer = get_channel_layer()
+    except Exception:
+        logger.exception('Could not get the channel layer to publish prices')
+        return
+
+    if channel_layer is None:
+        return
+
+    for code, price in prices.items():
+        try:
+            async_to_sync(channel_layer.group_send)(
+                price_group_name(code),
+                {
+                    'type': 'price.update',
+                    'price': price
+                }
+            )
+        except Exception:
+            logger.exception('Could not publish the price for {}'.format(code))
+
+
+def get_price_snapshot(currency_code, style):
+    """
+    Get the (date_time, rendered price) of the latest price for the currency, or None if there isn't a snapshot
+    """
+    if style == 'full':
+        return get_full_price_snapshot(currency_code)
+
+    return get_snapshot_cache().get(price_snapshot_key(currency_code, style))
+
+
+def get_full_price_snapshot(currency_code):
+    """
+    Get the full rendering of the price in the short snapshot, rendering and storing it on first use
+    """
+    latest = get_snapshot_cache().get(price_snapshot_key(currency_code, 'short'))
+
+    if latest is None:
+        return None
+
+    date_time = latest[0]
+    key = full_price_snapshot_key(currency_code, date_time)
+    snapshot = get_snapshot_cache().get(key)
+
+    if snapshot is not None:
+        return snapshot
+
+    agg_price = AggregatedPrice.objects.select_related(
+        'currency'
+    ).filter(
+        currency__code__iexact=currency_code,
+        date_time=date_time
+    ).first()
+
+    if agg_price is None:
+        return None
+
+    return get_full_price_renderings([agg_price])[agg_price.pk]
+
+
+def get_full_price_renderings(agg_prices):
+    """
+    Get the (date_time, full rendering) of each of the aggregated prices, keyed by pk.
+    Stored renderings are read from the cache together, the rest are rendered in one batch and stored
+    """
+    keys = {
+        agg_price.pk: full_price_snapshot_key(agg_price.currency.code, agg_price.date_time) for agg_price in agg_prices
+    }
+    stored = get_snapshot_cache().get_many(list(keys.values()))
+
+    renderings = {pk: stored[key] for pk, key in keys.items() if key in stored}
+    missing = [agg_price for agg_price in agg_prices if agg_price.pk not in renderings]
+
+    if missing:
+        contents = render_full_prices(missing)
+        rendered = {agg_price.pk: (agg_price.date_time, contents[agg_price.pk]) for agg_price in missing}
+        get_snapshot_cache().set_many(
+            {keys[pk]: snapshot for pk, snapshot in rendered.items()},
+            timeout=settings.PRICE_SNAPSHOT_TIMEOUT
+        )
+        renderings.update(rendered)
+
+    return renderings
@@ -1,6 +1,6 @@
 from .periodic_tasks import *
 from .get_provider_response import get_provider_response
-from .calculate_aggregate import calculate_aggregate
+from .calculate_aggregate import calculate_aggregate, calculate_all_aggregates
 from .calculate_arbitrage import calculate_arbitrage
 from .get_ccxt_response import get_ccxt_response
 
@@ -11,6 +11,8 @@ __all__ = [
     'get_provider_response',
     'calculate_aggregates',
     'calculate_aggregate',
+    'calculate_all_aggregates',
     'calculate_arbitrages',
-    'calculate_arbitrage'
+    'calculate_arbitrage',
+    'manage_response_partitions'
 ]
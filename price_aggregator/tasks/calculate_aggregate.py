@@ -1,13 +1,17 @@
-import math
-from decimal import Decimal
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 
-import numpy as np
 from celery.exceptions import Ignore
 from celery.utils.log import get_task_logger
+from django.db import DataError, IntegrityError, connections, router, transaction
+from django.db.models import Case, IntegerField, Value, When
 from django.utils.timezone import now
 
+from price_aggregator.aggregation import RESPONSE_FIELDS, aggregate, to_arrays
 from price_aggregator.celery import app
-from price_aggregator.models import Currency, ProviderResponse, Provider, AggregatedPrice
+from price_aggregator.models import Currency, ProviderResponse, Provider, AggregatedPrice, ProviderCoverage
+from price_aggregator.snapshots import store_price_snapshots
 
 logger = get_task_logger(__name__)
 
@@ -20,133 +24,205 @@ def calculate_aggregate(currency_pk):
     currency = Currency.objects.get(pk=currency_pk)
     logger.info('Working on {}'.format(currency))
 
-    # get the distinct providers from the provider responses
-    # this query ensures we get only the latest price from each provider
-    db_responses = ProviderResponse.objects.filter(
-        currency=currency,
-        update_by__gte=now(),
-        provider__active=True
+    # get the live responses from active providers.
+    # only the values needed for the calculation are fetched, newest first
+    db_responses = list(
+        ProviderResponse.objects.live().filter(
+            currency=currency
+        ).values_list(
+            *RESPONSE_FIELDS
+        )
     )
 
-    if db_responses.count() == 0:
+    if not db_responses:
         logger.warning('Got no valid responses for {}'.format(currency))
         raise Ignore()
 
-    # get valid responses
-    # this includes calculating a weighted mean of any 'market_provider' responses
-    valid_responses = calculate_weighted_mean(currency, db_responses)
+    # this includes calculating a weighted mean of any 'market_provider' responses and removing outliers
+    save_aggregates({currency.pk: currency}, {currency.pk: aggregate(*to_arrays(db_responses))})
 
-    # now we can remove outliers
-    cleaned_responses = remove_outliers(valid_responses)
 
-    # we want the values in order to use the numpy functions below
-    cleaned_values = [float(resp.value) for resp in cleaned_responses if resp.value > Decimal(0)]
+@app.task
+def calculate_all_aggregates():
+    """
+    Calculate the aggregate prices for every currency from a single query of the live responses
+    """
+    currencies = Currency.objects.in_bulk()
+
+    db_responses = ProviderResponse.objects.live().order_by(
+        'currency',
+        '-date_time'
+    ).values_list(
+        'currency_id',
+        *RESPONSE_FIELDS
+    )
 
-    aggregated_price = np.mean(cleaned_values)
+    # the responses are grouped by currency and each group is aggregated in turn
+    results = {
+        currency_id: aggregate(*to_arrays([row[1:] for row in rows]))
+        for currency_id, rows in groupby(db_responses.iterator(), key=itemgetter(0))
+    }
 
-    logger.info(
-        'Got an aggregated price of {} for {}'.format(aggregated_price, currency)
-    )
+    for currency_id, currency in currencies.items():
+        if currency_id not in results:
+            logger.warning('Got no valid responses for {}'.format(currency))
 
-    # create the aggregated price object
-    aggregated_price = AggregatedPrice.objects.create(
-        currency=currency,
-        aggregated_price=aggregated_price,
-        providers=len(cleaned_responses),
-        standard_deviation=np.std(cleaned_values),
-        variance=np.var(cleaned_values)
-    )
+    if results:
+        save_aggregates(currencies, results)
 
-    # then add the cleaned responses so the api shows which responses were used
-    for resp in cleaned_responses:
-        aggregated_price.used_responses.add(resp)
 
+def save_aggregates(currencies, results):
+    """
+    Save the AggregatedPrices (and any volume weighted responses) for the given aggregation results.
+    Both are keyed by currency pk.
+    They are saved together, falling back to one currency at a time if a row is rejected
+    so one bad result can't lose the prices of every other currency
+    """
+    # we assign a special Provider to the weighted results.
+    # It is fetched before the transaction so a rollback can't leave an unsaved provider cached
+    if any(result.weighted_mean is not None for result in results.values()):
+        weighted_provider = get_weighted_provider()
+    else:
+        weighted_provider = None
+
+    # the moving averages are kept with each price so they don't need calculating when it is served
+    moving_averages = AggregatedPrice.objects.calculate_moving_averages(
+        {currency_id: result.aggregated_price for currency_id, result in results.items()},
+        now()
+    )
 
-def calculate_weighted_mean(currency, responses):
+    try:
+        with transaction.atomic():
+            aggregated_prices = create_aggregates(currencies, results, weighted_provider, moving_averages)
+    except (IntegrityError, DataError) as e:
+        logger.warning('Saving the aggregates together failed ({}). Saving them one currency at a time'.format(e))
+        aggregated_prices = []
+
+        for currency_id, result in results.items():
+            try:
+                with transaction.atomic():
+                    aggregated_prices += create_aggregates(
+                        currencies,
+                        {currency_id: result},
+                        weighted_provider,
+                        moving_averages
+                    )
+            except (IntegrityError, DataError) as e:
+                logger.error('Could not save the aggregated price for {}: {}'.format(currencies[currency_id], e))
+
+    # render the new prices once now rather than on every request
+    store_price_snapshots(aggregated_prices)
+
+
+def create_aggregates(currencies, results, weighted_provider, moving_averages):
     """
-    some responses come from exchange pairs so should be weighted by volume
+    Create the AggregatedPrices, their used responses and any volume weighted responses.
+    Returns the new AggregatedPrices
     """
-    valid_responses = []
-    weighted_responses = []
-    used_providers = []
+    weighted_results = {
+        currency_id: (currencies[currency_id], result) for currency_id, result in results.items()
+        if result.weighted_mean is not None
+    }
 
-    for response in responses:
-        if math.isnan(response.value):
-            continue
+    calc_responses = save_weighted_responses(weighted_provider, weighted_results)
 
-        if response.provider in used_providers:
-            continue
+    aggregated_prices = []
+    used_ids = []
 
-        used_providers.append(response.provider)
+    for currency_id, result in results.items():
+        currency = currencies[currency_id]
 
-        if response.provider.exchange_provider:
-            # this is a market_provider so should be weighted
-            weighted_responses.append(response)
-        else:
-            # this is a standard response so should be treated as valid of itself
-            valid_responses.append(response)
-
-    if len(weighted_responses) > 0 and sum([float(resp.volume) for resp in weighted_responses]) > 0.0:
-        # we now have a list of values and their corresponding volumes.
-        # remove outliers
-        cleaned_weighted_responses = remove_outliers(weighted_responses)
-        # find the weighted mean
-        try:
-            weighted_mean = np.average(
-                [float(resp.value) for resp in cleaned_weighted_responses],
-                weights=[float(resp.volume) for resp in cleaned_weighted_responses]
-            )
-        except ZeroDivisionError:
-            weighted_mean = np.average(
-                [float(resp.value) for resp in cleaned_weighted_responses]
+        logger.info(
+            'Got an aggregated price of {} for {}'.format(result.aggregated_price, currency)
+        )
+
+        aggregated_prices.append(
+            AggregatedPrice(
+                currency=currency,
+                aggregated_price=result.aggregated_price,
+                providers=result.providers,
+                standard_deviation=result.standard_deviation,
+                variance=result.variance,
+                moving_averages=moving_averages[currency_id]
             )
+        )
+
+        if result.weighted_mean_used:
+            used_ids.append(result.used_ids + [calc_responses[currency_id].pk])
+        else:
+            used_ids.append(result.used_ids)
 
-        # the next step expects a list of response objects so we make one now
-        # first we assign a special Provider to the result
-        try:
-            weighted_provider = Provider.objects.get(name__iexact='Exchange Pairs Volume Weighted Average')
-        except Provider.DoesNotExist:
-            weighted_provider = Provider.objects.create(name='Exchange Pairs Volume Weighted Average')
+    # create the aggregated price objects
+    bulk_create_with_pks(AggregatedPrice, aggregated_prices)
 
-        # now we generate the response object
-        calc_response = ProviderResponse.objects.create(
-            provider=weighted_provider,
-            value=weighted_mean,
-            currency=currency,
-            update_by=now()
-        )
+    # then add the cleaned responses so the api shows which responses were used
+    AggregatedPrice.objects.add_used_responses(zip(aggregated_prices, used_ids))
 
-        # for weighted responses we add the calculated_response from above as the 'parent_response'
-        # to allow tracking of where the values came from
-        for response in weighted_responses:
-            response.parent_response = calc_response
-            response.save()
+    return aggregated_prices
 
-        valid_responses.append(calc_response)
 
-    return valid_responses
+def save_weighted_responses(weighted_provider, weighted_results):
+    """
+    Save the volume weighted means of the market responses as responses of their own.
+    weighted_results maps currency pk to a (currency, result) tuple.
+    Returns the new responses keyed by currency pk
+    """
+    if not weighted_results:
+        return {}
 
+    # now we generate the response objects
+    calc_responses = {
+        currency_id: ProviderResponse(
+            provider=weighted_provider,
+            value=result.weighted_mean,
+            currency=currency,
+            update_by=now()
+        ) for currency_id, (currency, result) in weighted_results.items()
+    }
+    bulk_create_with_pks(ProviderResponse, calc_responses.values())
+    ProviderCoverage.objects.record(calc_responses.values())
+
+    # for weighted responses we add the calculated_response from above as the 'parent_response'
+    # to allow tracking of where the values came from.
+    # A single update sets the parent for every currency
+    ProviderResponse.objects.filter(
+        pk__in=[pk for currency, result in weighted_results.values() for pk in result.weighted_ids]
+    ).update(
+        parent_response=Case(
+            *[
+                When(pk__in=result.weighted_ids, then=Value(calc_responses[currency_id].pk))
+                for currency_id, (currency, result) in weighted_results.items()
+            ],
+            output_field=IntegerField()
+        )
+    )
 
-def remove_outliers(responses):
-    ys = [float(resp.value) for resp in responses]
+    return calc_responses
 
-    if not ys:
-        return responses
 
-    quartile_1, quartile_3 = np.percentile(ys, [25, 75])
-    iqr = quartile_3 - quartile_1
-    lower_bound = quartile_1 - (iqr * 1.5)
-    upper_bound = quartile_3 + (iqr * 1.5)
+def bulk_create_with_pks(model, objs):
+    """
+    Create the objects in bulk where the database gives back their primary keys.
+    Backends that can't return rows from a bulk insert, like SQLite, save them one at a time instead
+    """
+    objs = list(objs)
 
-    cleaned_values = []
+    if connections[router.db_for_write(model)].features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objs)
 
-    for response in responses:
-        if float(response.value) > float(upper_bound):
-            continue
+    for obj in objs:
+        obj.save(force_insert=True)
 
-        if float(response.value) < float(lower_bound):
-            continue
+    return objs
 
-        cleaned_values.append(response)
 
-    return cleaned_values
+@lru_cache(maxsize=None)
+def get_weighted_provider():
+    """
+    Get the special Provider assigned to volume weighted responses.
+    This is looked up once per process
+    """
+    try:
+        return Provider.objects.get(name__iexact='Exchange Pairs Volume Weighted Average')
+    except Provider.DoesNotExist:
+        return Provider.objects.create(name='Exchange Pairs Volume Weighted Average')
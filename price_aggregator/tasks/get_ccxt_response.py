@@ -1,30 +1,97 @@
-import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
-from datetime import timedelta
 
-import ccxt
 from celery.exceptions import Ignore
 from celery.utils.log import get_task_logger
-from django.utils.timezone import now
+from django.conf import settings
 
+from price_aggregator.ccxt_registry import exchange_registry
 from price_aggregator.celery import app
-from price_aggregator.models import Currency, AggregatedPrice, Provider, ProviderBlackList, ProviderResponse
+from price_aggregator.models import Currency, AggregatedPrice
+from price_aggregator.response_sink import response_sink
 
 logger = get_task_logger(__name__)
 
 
-def get_latest_agg_price(currency):
-    if currency.upper() == 'USD':
-        return 1
+def get_conversion_rates():
+    """
+    Get the latest aggregated USD price for every currency in one query.
+    Returns a dict keyed by the upper case currency code
+    """
+    latest_prices = AggregatedPrice.objects.latest_per_currency().values_list(
+        'currency__code',
+        'aggregated_price'
+    )
+
+    rates = {code.upper(): aggregated_price for code, aggregated_price in latest_prices}
+    rates['USD'] = 1
+    return rates
+
+
+class RateLimiter(object):
+    """
+    Space out requests made from several threads so that together they honour the exchange rate limit
+    """
+    def __init__(self, rate_limit):
+        # ccxt gives the rate limit as milliseconds between requests
+        self.interval = (rate_limit or 0) / 1000
+        self.next_request = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            request_time = max(self.next_request, time.monotonic())
+            self.next_request = request_time + self.interval
 
-    current_agg_price = AggregatedPrice.objects.filter(
-        currency__code__iexact=currency
-    ).first()
+        delay = request_time - time.monotonic()
 
-    if current_agg_price is None:
-        return None
+        if delay > 0:
+            time.sleep(delay)
 
-    return current_agg_price.aggregated_price
+
+def fetch_tickers(wrapper, markets):
+    """
+    Get the tickers for the given markets as a dict keyed by market symbol.
+    The bulk fetchTickers call is used where the exchange supports it.
+    Otherwise the single tickers are fetched concurrently, bounded by CCXT_MAX_CONCURRENT_REQUESTS
+    """
+    symbols = [market['symbol'] for market in markets]
+
+    if not symbols:
+        return {}
+
+    if wrapper.has.get('fetchTickers'):
+        try:
+            return wrapper.fetch_tickers(symbols)
+        except Exception as e:
+            logger.warning('{}: Bulk ticker fetch failed ({}). Fetching single tickers'.format(wrapper.id, e))
+
+    # fetch_ticker loads the markets on first use without a lock,
+    # so they are loaded here rather than by every thread at once
+    wrapper.load_markets()
+
+    # the threads are spaced out by the one shared rate limiter.
+    # ccxt's own limiter is switched off meanwhile so the requests aren't throttled a second time
+    enable_rate_limit = wrapper.enableRateLimit
+    rate_limiter = RateLimiter(wrapper.rateLimit if enable_rate_limit else 0)
+
+    def fetch_ticker(symbol):
+        rate_limiter.wait()
+
+        try:
+            return symbol, wrapper.fetch_ticker(symbol)
+        except Exception:
+            return symbol, None
+
+    wrapper.enableRateLimit = False
+
+    try:
+        with ThreadPoolExecutor(max_workers=settings.CCXT_MAX_CONCURRENT_REQUESTS) as executor:
+            return {symbol: ticker for symbol, ticker in executor.map(fetch_ticker, symbols) if ticker is not None}
+    finally:
+        wrapper.enableRateLimit = enable_rate_limit
 
 
 @app.task
@@ -33,7 +100,7 @@ def get_ccxt_response(exchange):
     Get the ticker response from a single exchange via the ccxt wrapper
     """
     try:
-        wrapper = getattr(ccxt, exchange)()
+        wrapper = exchange_registry.get_exchange(exchange)
     except Exception:
         raise Ignore
 
@@ -42,26 +109,23 @@ def get_ccxt_response(exchange):
     currencies = Currency.objects.all()
     currency_check_list = [c.code.upper() for c in currencies] + ['USD']
 
+    # only the markets where both sides are currencies we know about are useful
     try:
-        markets = wrapper.fetch_markets()
+        markets = exchange_registry.get_relevant_markets(exchange, currency_check_list)
     except Exception as e:
         raise Ignore
 
-    prices = []
+    tickers = fetch_tickers(wrapper, markets)
 
-    for market in markets:
-        if market['base'] is None or market['quote'] is None:
-            continue
+    # the USD prices used to convert market prices only need fetching once per run
+    conversion_rates = get_conversion_rates()
 
-        if market['base'].upper() not in currency_check_list:
-            continue
+    prices = []
 
-        if market['quote'].upper() not in currency_check_list:
-            continue
+    for market in markets:
+        ticker = tickers.get(market['symbol'])
 
-        try:
-            ticker = wrapper.fetchTicker(market['symbol'])
-        except Exception:
+        if ticker is None:
             continue
 
         if ticker['last'] is None:
@@ -84,8 +148,8 @@ def get_ccxt_response(exchange):
         else:
             quote_volume = Decimal(0.0)
 
-        current_base_price_usd = get_latest_agg_price(market['base'])
-        current_quote_price_usd = get_latest_agg_price(market['quote'])
+        current_base_price_usd = conversion_rates.get(market['base'].upper())
+        current_quote_price_usd = conversion_rates.get(market['quote'].upper())
 
         if current_base_price_usd is None:
             logger.error('Failed to fetch an aggregated price for {}'.format(market['base']))
@@ -123,35 +187,5 @@ def get_ccxt_response(exchange):
                     }
                 )
 
-    for price in prices:
-        if math.isnan(price['price']):
-            continue
-
-        try:
-            price_provider = Provider.objects.get(name__iexact=price['provider'])
-        except Provider.DoesNotExist:
-            # the market_provider field comes from the 'parent' provider
-            price_provider = Provider.objects.create(
-                name=price['provider'],
-                exchange_provider=True,
-                cache=300
-            )
-
-        # if the provider is blacklisted, we skip.
-        # We perform this check here otherwise market_providers cannot be individually blacklisted
-        try:
-            ProviderBlackList.objects.get(currency=price['coin'], provider=price_provider)
-            continue
-        except ProviderBlackList.DoesNotExist:
-            pass
-
-        logger.info('Saving {} from {}: {:.8f}'.format(price['coin'], price_provider.name, price['price']))
-
-        ProviderResponse.objects.create(
-            provider=price_provider,
-            currency=price['coin'],
-            value=price['price'],
-            market_value=price.get('market_price', 0),
-            volume=price.get('volume'),
-            update_by=now() + timedelta(seconds=price_provider.cache)
-        )
+    # the market_providers are created as exchange providers
+    response_sink.save(prices, exchange_provider=True, cache=300)
@@ -5,7 +5,8 @@ from django.utils.timezone import now
 
 from price_aggregator import providers
 from price_aggregator.celery import app
-from price_aggregator.models import ProviderResponse, Provider, Currency, ProviderFailure, ProviderBlackList
+from price_aggregator.models import ProviderResponse, Provider, Currency, ProviderFailure
+from price_aggregator.response_sink import response_sink
 from celery.utils.log import get_task_logger
 
 logger = get_task_logger(__name__)
@@ -68,35 +69,11 @@ def get_provider_response(provider_name):
         raise Ignore()
 
     # we have some price data
-    for price in prices:
-        # new providers can be created from new market data as 'market_providers'
-        # the name of the market_provider is passed back in the price data under the 'provider' key
-        try:
-            price_provider = Provider.objects.get(name__iexact=price.get('provider', provider_name))
-        except Provider.DoesNotExist:
-            # the market_provider field comes from the 'parent' provider
-            price_provider = Provider.objects.create(
-                name=price.get('provider', provider_name),
-                exchange_provider=provider.exchange_provider,
-                cache=provider.cache
-            )
-
-        # if the provider is blacklisted, we skip.
-        # We perform this check here otherwise market_providers cannot be individually blacklisted
-        try:
-            ProviderBlackList.objects.get(currency=price['coin'], provider=price_provider)
-            continue
-        except ProviderBlackList.DoesNotExist:
-            pass
-
-        logger.info('Saving {} from {}: {:.8f}'.format(price['coin'], price_provider.name, price['price']))
-
-        ProviderResponse.objects.create(
-            provider=price_provider,
-            currency=price['coin'],
-            value=price['price'],
-            market_value=price.get('market_price', 0),
-            volume=price.get('volume'),
-            update_by=now() + timedelta(seconds=price_provider.cache)
-        )
-
+    # new providers can be created from new market data as 'market_providers'
+    # the market_provider fields come from the 'parent' provider
+    response_sink.save(
+        prices,
+        provider_name=provider_name,
+        exchange_provider=provider.exchange_provider,
+        cache=provider.cache
+    )
@@ -3,10 +3,13 @@ from datetime import timedelta
 import ccxt
 from celery import signature, group
 from celery.utils.log import get_task_logger
+from django.conf import settings
 from django.utils.timezone import now
 
+from price_aggregator import partitions
 from price_aggregator import providers
 from price_aggregator import tasks
+from price_aggregator.ccxt_registry import exchange_registry
 from price_aggregator.celery import app
 from price_aggregator.models import Currency, ProviderResponse
 
@@ -22,7 +25,7 @@ def get_ccxt_responses():
 
     for exchange in ccxt.exchanges:
         try:
-            wrapper = getattr(ccxt, exchange)()
+            wrapper = exchange_registry.get_exchange(exchange)
         except Exception:
             continue
 
@@ -80,6 +83,11 @@ def calculate_aggregates():
     """
     Calculate the aggregate prices from the latest provider responses
     """
+    if settings.CALCULATE_AGGREGATES_IN_BATCH:
+        # a single task calculates every currency
+        getattr(tasks, 'calculate_all_aggregates').apply_async()
+        return
+
     aggregate_list = []
 
     for currency in Currency.objects.all():
@@ -123,3 +131,19 @@ def calculate_arbitrages():
     arbitrage_group = group(arbitrage_list)
     # then run the group
     arbitrage_group.apply_async()
+
+
+@app.task
+def manage_response_partitions():
+    """
+    Create the upcoming ProviderResponse partitions and drop those past the retention period
+    """
+    if not settings.PROVIDER_RESPONSE_PARTITION_INTERVAL or not partitions.is_partitioned():
+        logger.info('ProviderResponse is not partitioned')
+        return
+
+    partitions.create_partitions(
+        settings.PROVIDER_RESPONSE_PARTITION_INTERVAL,
+        settings.PROVIDER_RESPONSE_PARTITIONS_AHEAD
+    )
+    partitions.drop_partitions(now() - timedelta(days=settings.PROVIDER_RESPONSE_RETENTION_DAYS))
@@ -1,3 +1,687 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import math
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils.timezone import make_aware, now
+
+from price_aggregator.aggregation import aggregate, to_arrays
+from price_aggregator.models import AggregatedPrice, ArbitrageOpportunity, Currency, Provider, ProviderBlackList, ProviderCoverage, \
+    ProviderResponse
+from price_aggregator.response_sink import ResponseSink
+from price_aggregator.routing import application
+from price_aggregator import partitions, snapshots
+from price_aggregator.tasks.calculate_aggregate import calculate_all_aggregates, get_weighted_provider, \
+    save_aggregates
+
+
+def run_aggregate(rows):
+    """
+    Aggregate rows of (id, provider_id, value, volume, exchange_provider) given newest first
+    """
+    return aggregate(*to_arrays(rows))
+
+
+def create_response(provider, currency, value, **kwargs):
+    """
+    Create a ProviderResponse that is live for the next five minutes
+    """
+    kwargs.setdefault('update_by', now() + timedelta(minutes=5))
+    return ProviderResponse.objects.create(provider=provider, currency=currency, value=value, **kwargs)
+
+
+def create_price(currency, value, **kwargs):
+    """
+    Create an AggregatedPrice, optionally moving it to the given date_time
+    """
+    date_time = kwargs.pop('date_time', None)
+    agg_price = AggregatedPrice.objects.create(currency=currency, aggregated_price=value, **kwargs)
+
+    if date_time is not None:
+        AggregatedPrice.objects.filter(pk=agg_price.pk).update(date_time=date_time)
+        agg_price.refresh_from_db()
+
+    return agg_price
+
+
+class AggregateTestCase(SimpleTestCase):
+    def test_latest_response_per_provider(self):
+        result = run_aggregate([
+            (1, 1, 10, None, False),
+            (2, 1, 100, None, False),
+            (3, 2, 11, None, False),
+            (4, 3, 12, None, False)
+        ])
+
+        self.assertEqual(result.used_ids, [1, 3, 4])
+        self.assertEqual(result.providers, 3)
+        self.assertAlmostEqual(result.aggregated_price, 11)
+
+    def test_nan_values_are_skipped(self):
+        result = run_aggregate([
+            (1, 1, float('nan'), None, False),
+            (2, 1, 10, None, False),
+            (3, 2, 12, None, False)
+        ])
+
+        # the older response from the provider is used in place of the nan
+        self.assertEqual(result.used_ids, [2, 3])
+        self.assertAlmostEqual(result.aggregated_price, 11)
+
+    def test_outliers_are_removed(self):
+        result = run_aggregate([
+            (1, 1, 10, None, False),
+            (2, 2, 10, None, False),
+            (3, 3, 11, None, False),
+            (4, 4, 11, None, False),
+            (5, 5, 1000, None, False)
+        ])
+
+        self.assertEqual(result.used_ids, [1, 2, 3, 4])
+        self.assertEqual(result.providers, 4)
+        self.assertAlmostEqual(result.aggregated_price, 10.5)
+        self.assertAlmostEqual(result.standard_deviation, 0.5)
+        self.assertAlmostEqual(result.variance, 0.25)
+
+    def test_weighted_mean(self):
+        result = run_aggregate([
+            (1, 1, 10, None, False),
+            (2, 2, 12, None, False),
+            (3, 3, 11, 1, True),
+            (4, 4, 13, 3, True)
+        ])
+
+        self.assertEqual(result.weighted_ids, [3, 4])
+        self.assertAlmostEqual(result.weighted_mean, 12.5)
+        self.assertTrue(result.weighted_mean_used)
+        self.assertEqual(result.used_ids, [1, 2])
+        self.assertEqual(result.providers, 3)
+        self.assertAlmostEqual(result.aggregated_price, 11.5)
+
+    def test_weighted_outliers_are_removed(self):
+        result = run_aggregate([
+            (1, 1, 11, 1, True),
+            (2, 2, 11, 1, True),
+            (3, 3, 11, 1, True),
+            (4, 4, 50, 100, True)
+        ])
+
+        self.assertAlmostEqual(result.weighted_mean, 11)
+        self.assertTrue(result.weighted_mean_used)
+        self.assertEqual(result.used_ids, [])
+        self.assertEqual(result.providers, 1)
+        self.assertAlmostEqual(result.aggregated_price, 11)
+
+    def test_zero_volume_has_no_weighted_mean(self):
+        result = run_aggregate([
+            (1, 1, 10, None, False),
+            (2, 2, 12, None, False),
+            (3, 3, 100, 0, True),
+            (4, 4, 200, None, True)
+        ])
+
+        self.assertIsNone(result.weighted_mean)
+        self.assertFalse(result.weighted_mean_used)
+        self.assertEqual(result.used_ids, [1, 2])
+        self.assertEqual(result.providers, 2)
+        self.assertAlmostEqual(result.aggregated_price, 11)
+
+    def test_weighted_mean_dropped_as_outlier(self):
+        result = run_aggregate([
+            (1, 1, 10, None, False),
+            (2, 2, 10, None, False),
+            (3, 3, 10, None, False),
+            (4, 4, 10, None, False),
+            (5, 5, 100, 1, True),
+            (6, 6, 100, 1, True)
+        ])
+
+        self.assertAlmostEqual(result.weighted_mean, 100)
+        self.assertFalse(result.weighted_mean_used)
+        self.assertEqual(result.used_ids, [1, 2, 3, 4])
+        self.assertEqual(result.providers, 4)
+        self.assertAlmostEqual(result.aggregated_price, 10)
+
+    def test_no_positive_values(self):
+        result = run_aggregate([
+            (1, 1, 0, None, False),
+            (2, 2, 0, None, False)
+        ])
+
+        self.assertEqual(result.used_ids, [1, 2])
+        self.assertTrue(math.isnan(result.aggregated_price))
+
+
+class ResponseSinkTestCase(TestCase):
+    def setUp(self):
+        self.btc = Currency.objects.create(code='BTC', name='Bitcoin')
+        self.sink = ResponseSink(ttl=300)
+
+    def test_prices_that_are_not_numbers_are_skipped(self):
+        responses = self.sink.save(
+            [
+                {'coin': self.btc, 'price': '10.5'},
+                {'coin': self.btc, 'price': float('nan')},
+                {'coin': self.btc, 'price': None},
+                {'coin': self.btc, 'price': 'n/a'}
+            ],
+            provider_name='CoinApi'
+        )
+
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(list(ProviderResponse.objects.values_list('value', flat=True)), [10.5])
+
+    def test_market_providers_are_matched_or_created(self):
+        existing = Provider.objects.create(name='Binance_BTC_USDT')
+
+        self.sink.save(
+            [
+                {'coin': self.btc, 'price': 1, 'provider': 'binance_btc_usdt'},
+                {'coin': self.btc, 'price': 2, 'provider': 'Kraken_BTC_USD'}
+            ],
+            exchange_provider=True,
+            cache=120
+        )
+
+        created = Provider.objects.get(name='Kraken_BTC_USD')
+        self.assertTrue(created.exchange_provider)
+        self.assertEqual(created.cache, 120)
+        self.assertEqual(
+            set(ProviderResponse.objects.values_list('provider_id', flat=True)),
+            {existing.pk, created.pk}
+        )
+
+    def test_blacklist_changes_are_picked_up_before_the_ttl(self):
+        provider = Provider.objects.create(name='CoinApi')
+        self.sink.save([{'coin': self.btc, 'price': 1}], provider_name='CoinApi')
+
+        ProviderBlackList.objects.create(currency=self.btc, provider=provider)
+        self.sink.save([{'coin': self.btc, 'price': 2}], provider_name='CoinApi')
+
+        self.assertEqual(list(ProviderResponse.objects.values_list('value', flat=True)), [1])
+
+
+class SaveAggregatesTestCase(TestCase):
+    def test_a_rejected_currency_does_not_lose_the_others(self):
+        provider = Provider.objects.create(name='CoinApi')
+        currencies = {}
+        results = {}
+
+        for code, value in (('BTC', 10), ('ETH', 20)):
+            currency = Currency.objects.create(code=code, name=code)
+            response = create_response(provider, currency, value)
+            currencies[currency.pk] = currency
+            results[currency.pk] = run_aggregate([(response.pk, provider.pk, value, None, False)])
+
+        add_used_responses = AggregatedPrice.objects.add_used_responses
+
+        def reject_eth(prices_and_ids):
+            prices_and_ids = list(prices_and_ids)
+
+            if any(agg_price.currency.code == 'ETH' for agg_price, used_ids in prices_and_ids):
+                raise IntegrityError('rejected')
+
+            add_used_responses(prices_and_ids)
+
+        with mock.patch.object(AggregatedPrice.objects, 'add_used_responses', side_effect=reject_eth):
+            save_aggregates(currencies, results)
+
+        agg_price = AggregatedPrice.objects.get()
+        self.assertEqual(agg_price.currency.code, 'BTC')
+        self.assertEqual(agg_price.aggregated_price, 10)
+        self.assertEqual(agg_price.used_responses.count(), 1)
+
+
+class ResponseMovingAveragesTestCase(TestCase):
+    def test_window_runs_from_its_start_up_to_now(self):
+        provider = Provider.objects.create(name='CoinApi')
+        currency = Currency.objects.create(code='BTC', name='Bitcoin')
+        current_time = now()
+        responses = {}
+
+        for minutes_ago, value in ((45, 10), (20, 20), (10, 30), (0, 40)):
+            response = create_response(provider, currency, value)
+            ProviderResponse.objects.filter(pk=response.pk).update(
+                date_time=current_time - timedelta(minutes=minutes_ago)
+            )
+            responses[minutes_ago] = response
+
+        moving_averages = ProviderResponse.objects.calculate_moving_averages(responses.values())
+
+        # the 30 minute window of each response includes the responses saved after it
+        self.assertEqual(moving_averages[responses[20].pk], {'30_minute': 25})
+        self.assertEqual(moving_averages[responses[10].pk], {'30_minute': 30})
+        self.assertEqual(moving_averages[responses[0].pk], {'30_minute': 30})
+
+
+class PriceSnapshotTestCase(TestCase):
+    def setUp(self):
+        snapshots.get_snapshot_cache().clear()
+        self.btc = Currency.objects.create(code='BTC', name='Bitcoin')
+        self.eth = Currency.objects.create(code='ETH', name='Ethereum')
+
+    def test_the_latest_stored_price_is_served(self):
+        snapshots.store_price_snapshots([create_price(self.btc, 100)])
+        newer = create_price(self.btc, 200)
+        snapshots.store_price_snapshots([newer])
+
+        date_time, content = snapshots.get_price_snapshot('btc', 'short')
+        self.assertEqual(date_time, newer.date_time)
+        self.assertEqual(json.loads(content)['aggregated_usd_price'], 200)
+        self.assertIsNotNone(snapshots.get_price_snapshot('BTC', snapshots.MOVEMENT_STYLE))
+
+    def test_a_failed_render_removes_only_that_currencys_snapshots(self):
+        snapshots.store_price_snapshots([create_price(self.btc, 100), create_price(self.eth, 10)])
+        new_prices = [create_price(self.btc, 200), create_price(self.eth, 20)]
+        render_movements = snapshots.render_movements
+
+        def fail_for_eth(agg_price):
+            if agg_price.currency.code == 'ETH':
+                raise ValueError('render failed')
+
+            return render_movements(agg_price)
+
+        with mock.patch('price_aggregator.snapshots.render_movements', side_effect=fail_for_eth), \
+                self.assertLogs('price_aggregator.snapshots', 'ERROR'):
+            snapshots.store_price_snapshots(new_prices)
+
+        self.assertEqual(snapshots.get_price_snapshot('BTC', 'short')[0], new_prices[0].date_time)
+        # the old ETH price mustn't be served as the latest
+        self.assertIsNone(snapshots.get_price_snapshot('ETH', 'short'))
+        self.assertIsNone(snapshots.get_price_snapshot('ETH', snapshots.MOVEMENT_STYLE))
+
+    def test_a_publish_failure_does_not_stop_the_snapshots(self):
+        agg_price = create_price(self.btc, 100)
+
+        with mock.patch('price_aggregator.snapshots.get_channel_layer', side_effect=RuntimeError('no layer')), \
+                self.assertLogs('price_aggregator.snapshots', 'ERROR'):
+            snapshots.store_price_snapshots([agg_price])
+
+        self.assertEqual(snapshots.get_price_snapshot('BTC', 'short')[0], agg_price.date_time)
+
+    def test_the_full_style_is_rendered_on_demand(self):
+        agg_price = create_price(self.btc, 100)
+        snapshots.store_price_snapshots([agg_price])
+
+        date_time, content = snapshots.get_price_snapshot('BTC', 'full')
+        self.assertEqual(date_time, agg_price.date_time)
+        self.assertIn('moving_averages', json.loads(content))
+
+
+class AggregatedPricesTestCase(TestCase):
+    """
+    Aggregated prices for BTC, ETH and USNBT from a mix of plain and market providers
+    """
+    def setUp(self):
+        snapshots.get_snapshot_cache().clear()
+        get_weighted_provider.cache_clear()
+
+        self.currencies = [
+            Currency.objects.create(code=code, name=code) for code in ('BTC', 'ETH', 'USNBT')
+        ]
+        providers = [Provider.objects.create(name='provider_{}'.format(index)) for index in range(3)] + [
+            Provider.objects.create(name='market_{}'.format(index), exchange_provider=True) for index in range(2)
+        ]
+
+        for currency_index, currency in enumerate(self.currencies):
+            for provider_index, provider in enumerate(providers):
+                create_response(provider, currency, 100 * (currency_index + 1) + provider_index, volume=1)
+
+        calculate_all_aggregates()
+
+
+class PricesViewTestCase(AggregatedPricesTestCase):
+    def test_prices_match_the_price_endpoint(self):
+        prices = self.client.get('/prices?codes=btc,NBT,unknown').json()
+
+        self.assertEqual(sorted(prices), ['BTC', 'USNBT'])
+        self.assertEqual(prices['BTC'], self.client.get('/price/btc').json())
+        self.assertEqual(sorted(self.client.get('/prices').json()), ['BTC', 'ETH', 'USNBT'])
+
+    def test_full_prices_match_the_price_endpoint(self):
+        prices = self.client.get('/prices?full').json()
+
+        for code in ('BTC', 'ETH', 'USNBT'):
+            self.assertEqual(prices[code], self.client.get('/price/{}?full'.format(code)).json())
+
+    def test_full_prices_are_rendered_together(self):
+        # the latest prices, their used responses, the two levels of combined responses
+        # and the moving averages. None of which grows with the number of currencies
+        with self.assertNumQueries(5):
+            self.client.get('/prices?full')
+
+        # and once rendered they come from the cache
+        with self.assertNumQueries(1):
+            self.client.get('/prices?full')
+
+
+class ConditionalRequestTestCase(AggregatedPricesTestCase):
+    def assert_conditional(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        return response
+
+    def test_price_endpoints_answer_conditional_requests(self):
+        for url in ('/price/btc', '/price/btc?full', '/movement/btc'):
+            with self.subTest(url=url):
+                self.assert_conditional(url)
+
+                # the same when the price isn't in the cache
+                snapshots.get_snapshot_cache().clear()
+                self.assert_conditional(url)
+
+    def test_styles_have_different_etags(self):
+        self.assertNotEqual(self.client.get('/price/btc')['ETag'], self.client.get('/price/btc?full')['ETag'])
+
+    def test_a_new_price_changes_the_etag(self):
+        etag = self.client.get('/price/btc')['ETag']
+        snapshots.store_price_snapshots([create_price(self.currencies[0], 500, date_time=now() + timedelta(seconds=1))])
+
+        response = self.client.get('/price/btc', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['aggregated_usd_price'], 500)
+
+
+class PriceConsumerTestCase(SimpleTestCase):
+    def run_communicator(self, path, conversation):
+        async def run():
+            communicator = WebsocketCommunicator(application, path)
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+
+            try:
+                await conversation(communicator)
+            finally:
+                await communicator.disconnect()
+
+        async_to_sync(run)()
+
+    def test_prices_are_pushed_to_subscribers(self):
+        async def conversation(communicator):
+            await sync_to_async(snapshots.publish_prices)({'BTC': '{"currency": "BTC"}', 'ETH': '{"currency": "ETH"}'})
+            self.assertEqual(await communicator.receive_json_from(), {'currency': 'BTC'})
+            self.assertTrue(await communicator.receive_nothing())
+
+        self.run_communicator('/ws/prices?codes=btc', conversation)
+
+    def test_subscriptions_can_be_changed(self):
+        async def conversation(communicator):
+            await communicator.send_json_to({'subscribe': ['ETH', 'nbt'], 'unsubscribe': ['btc']})
+            self.assertEqual(await communicator.receive_json_from(), {'subscribed': ['eth', 'usnbt']})
+
+        self.run_communicator('/ws/prices?codes=btc', conversation)
+
+    def test_invalid_messages_get_an_error(self):
+        async def conversation(communicator):
+            for message in (['btc'], {'subscribe': 'btc'}, {'subscribe': [5]}, {'unsubscribe': None}):
+                await communicator.send_json_to(message)
+                self.assertIn('error', await communicator.receive_json_from())
+
+            # and the connection is still usable
+            await communicator.send_json_to({'subscribe': ['btc']})
+            self.assertEqual(await communicator.receive_json_from(), {'subscribed': ['btc']})
+
+        self.run_communicator('/ws/prices', conversation)
+
+
+class HistoryViewTestCase(TestCase):
+    def setUp(self):
+        currency = Currency.objects.create(code='USNBT', name='NuBits')
+        start = make_aware(datetime(2020, 1, 1))
+
+        for minutes, value in enumerate([10, 12, 8, 11, 20, 21, 19, 22, 30]):
+            create_price(currency, value, date_time=start + timedelta(minutes=minutes))
+
+    def get_history(self, query):
+        response = self.client.get('/history/nbt?from=2020-01-01T00:00:00&to=2020-01-01T00:08:00&{}'.format(query))
+        return b''.join(response.streaming_content).decode()
+
+    def test_prices_are_bucketed(self):
+        history = json.loads(self.get_history('interval=4m'))
+
+        self.assertEqual(history['currency'], 'USNBT')
+        self.assertEqual(history['interval'], 240)
+        self.assertEqual(history['columns'], ['time', 'open', 'high', 'low', 'close', 'mean', 'samples'])
+        # the price at the end time isn't included
+        self.assertEqual(
+            history['data'],
+            [
+                [1577836800, 10, 12, 8, 11, 10.25, 4],
+                [1577837040, 20, 22, 19, 22, 20.5, 4]
+            ]
+        )
+
+    def test_history_as_csv(self):
+        rows = list(csv.reader(io.StringIO(self.get_history('interval=4m&format=csv'))))
+
+        self.assertEqual(rows[0], ['time', 'open', 'high', 'low', 'close', 'mean', 'samples'])
+        self.assertEqual(rows[1], ['1577836800', '10.0', '12.0', '8.0', '11.0', '10.25', '4'])
+        self.assertEqual(len(rows), 3)
+
+    def test_interval_is_widened_to_the_point_cap(self):
+        with self.settings(HISTORY_MAX_POINTS=2):
+            history = json.loads(self.get_history('interval=1m'))
+
+        self.assertEqual(history['interval'], 240)
+        self.assertEqual(len(history['data']), 2)
+
+    def test_invalid_intervals_get_an_error(self):
+        self.assertIn('error', self.client.get('/history/nbt?interval=5x').json())
+        self.assertIn('error', self.client.get('/history/nbt?interval=0').json())
+
+
+class ProviderCoverageTestCase(TestCase):
+    def setUp(self):
+        self.btc = Currency.objects.create(code='BTC', name='Bitcoin')
+        self.eth = Currency.objects.create(code='ETH', name='Ethereum')
+        self.coin_api = Provider.objects.create(name='CoinApi')
+        self.bittrex = Provider.objects.create(name='Bittrex')
+
+    def test_saved_responses_are_recorded(self):
+        sink = ResponseSink()
+        sink.save([{'coin': self.btc, 'price': 1}, {'coin': self.eth, 'price': 2}], provider_name='CoinApi')
+        sink.save([{'coin': self.btc, 'price': 3}], provider_name='Bittrex')
+
+        self.assertEqual(
+            set(ProviderCoverage.objects.values_list('provider__name', 'currency__code')),
+            {('CoinApi', 'BTC'), ('CoinApi', 'ETH'), ('Bittrex', 'BTC')}
+        )
+
+    def test_last_seen_only_moves_forward(self):
+        newer = create_response(self.coin_api, self.btc, 1)
+        older = create_response(self.coin_api, self.btc, 2)
+        ProviderResponse.objects.filter(pk=older.pk).update(date_time=newer.date_time - timedelta(hours=1))
+        older.refresh_from_db()
+
+        ProviderCoverage.objects.record([newer])
+        ProviderCoverage.objects.record([older])
+
+        self.assertEqual(ProviderCoverage.objects.get().last_seen, newer.date_time)
+
+    def test_currencies_and_providers_show_current_coverage(self):
+        ProviderCoverage.objects.record([create_response(self.coin_api, self.btc, 1)])
+        ProviderCoverage.objects.create(
+            provider=self.bittrex,
+            currency=self.eth,
+            last_seen=now() - timedelta(days=2)
+        )
+
+        self.assertEqual(self.client.get('/currencies?full').json(), {'BTC': ['CoinApi'], 'ETH': []})
+
+        providers = self.client.get('/providers').json()
+        self.assertEqual(providers['CoinApi']['supported_currencies'], ['BTC'])
+        self.assertEqual(providers['Bittrex']['supported_currencies'], [])
+
+    def test_the_latest_response_is_pointed_at(self):
+        sink = ResponseSink()
+        sink.save([{'coin': self.btc, 'price': 1}], provider_name='CoinApi')
+        latest = sink.save([{'coin': self.btc, 'price': 2}], provider_name='CoinApi')
+
+        self.assertEqual(ProviderCoverage.objects.latest_response(self.coin_api, self.btc).value, 2)
+        self.assertEqual(self.client.get('/provider/coinapi/price/btc').json()['usd_price'], 2)
+        self.assertIn('error', self.client.get('/provider/coinapi/price/eth').json())
+        self.assertIn('error', self.client.get('/provider/bittrex/price/btc').json())
+
+        # once the latest response is removed the newest one left is used
+        ProviderResponse.objects.filter(value=latest[0].value).delete()
+        self.assertEqual(self.client.get('/provider/coinapi/price/btc').json()['usd_price'], 1)
+
+
+class ClosestToTestCase(TestCase):
+    def setUp(self):
+        self.btc = Currency.objects.create(code='BTC', name='Bitcoin')
+        self.provider = Provider.objects.create(name='CoinApi')
+        self.start = make_aware(datetime(2020, 1, 1))
+
+        for minutes in (0, 10, 20):
+            create_price(self.btc, minutes, date_time=self.start + timedelta(minutes=minutes))
+            response = create_response(self.provider, self.btc, minutes)
+            ProviderResponse.objects.filter(pk=response.pk).update(date_time=self.start + timedelta(minutes=minutes))
+
+    def test_the_closest_price_to_each_target(self):
+        targets = [self.start + timedelta(minutes=minutes) for minutes in (4, 16, 100, -5, 11)]
+
+        with self.assertNumQueries(1 if connection.features.supports_slicing_ordering_in_compound else 10):
+            closest = AggregatedPrice.objects.get_closest_to_many(self.btc, targets)
+
+        self.assertEqual([agg_price.aggregated_price for agg_price in closest], [0, 20, 20, 0, 10])
+
+    def test_the_closest_provider_response(self):
+        response = ProviderResponse.objects.get_closest_to(self.provider, self.btc, self.start + timedelta(minutes=8))
+        self.assertEqual(response.value, 10)
+
+    def test_no_rows_raises_does_not_exist(self):
+        eth = Currency.objects.create(code='ETH', name='Ethereum')
+
+        with self.assertRaises(AggregatedPrice.DoesNotExist):
+            AggregatedPrice.objects.get_closest_to(eth, self.start)
+
+
+class PriceMovementTestCase(TestCase):
+    def setUp(self):
+        snapshots.get_snapshot_cache().clear()
+        btc = Currency.objects.create(code='BTC', name='Bitcoin')
+        latest_time = now()
+
+        # a few minutes off the day so none are exactly on a target
+        for days, value in ((7, 50), (1, 100)):
+            create_price(btc, value, date_time=latest_time - timedelta(days=days, minutes=-5))
+
+        self.latest = create_price(btc, 200, date_time=latest_time)
+
+    def test_movements_from_the_closest_prices(self):
+        movements = self.client.get('/movement/btc').json()
+
+        self.assertEqual(movements['latest_price'], 200)
+        self.assertEqual(
+            {days: movement['price'] for days, movement in movements['number_of_days'].items()},
+            {'1': 100, '2': 100, '3': 100, '7': 50, '14': 50, '30': 50}
+        )
+        self.assertEqual(movements['number_of_days']['7']['movement_factor'], 4)
+        self.assertEqual(movements['number_of_days']['1']['movement_percentage'], 100)
+
+    def test_stored_movements_match_the_calculated_ones(self):
+        calculated = self.client.get('/movement/btc').json()
+        snapshots.store_price_snapshots([self.latest])
+
+        with self.assertNumQueries(0):
+            stored = self.client.get('/movement/btc').json()
+
+        self.assertEqual(stored, calculated)
+
+
+class RemoveOldResponsesTestCase(TestCase):
+    def setUp(self):
+        self.btc = Currency.objects.create(code='BTC', name='Bitcoin')
+        self.provider = Provider.objects.create(name='CoinApi')
+
+    def create_response(self, days_old, parent=None):
+        response = create_response(self.provider, self.btc, 1, parent_response=parent)
+        ProviderResponse.objects.filter(pk=response.pk).update(date_time=now() - timedelta(days=days_old))
+        return response
+
+    def test_old_responses_are_removed_like_the_orm_would(self):
+        old_parent = self.create_response(40)
+        self.create_response(41, parent=old_parent)
+        self.create_response(1, parent=old_parent)
+        new_parent = self.create_response(1)
+        self.create_response(41, parent=new_parent)
+        old_response = self.create_response(35)
+        new_response = self.create_response(1)
+
+        agg_price = create_price(self.btc, 1)
+        agg_price.used_responses.set([old_response, new_response])
+        ArbitrageOpportunity.objects.create(
+            currency=self.btc,
+            low_provider_response=old_response,
+            high_provider_response=new_response
+        )
+        ProviderCoverage.objects.create(
+            provider=self.provider,
+            currency=self.btc,
+            last_seen=now(),
+            latest_response=old_response
+        )
+
+        call_command('remove_old_responses', days=30, batch_size=2, sleep=0)
+
+        # responses combined into a removed response go with it, as on_delete=CASCADE does
+        self.assertEqual(set(ProviderResponse.objects.all()), {new_parent, new_response})
+
+        self.assertEqual(list(agg_price.used_responses.all()), [new_response])
+        self.assertFalse(ArbitrageOpportunity.objects.exists())
+        self.assertIsNone(ProviderCoverage.objects.get().latest_response)
+
+    def test_nothing_to_remove(self):
+        new_response = self.create_response(1)
+
+        call_command('remove_old_responses', days=30, sleep=0)
+
+        self.assertEqual(list(ProviderResponse.objects.all()), [new_response])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Partitioning needs PostgreSQL')
+class PartitionTestCase(TransactionTestCase):
+    def setUp(self):
+        self.btc = Currency.objects.create(code='BTC', name='Bitcoin')
+        self.provider = Provider.objects.create(name='CoinApi')
+
+    def get_foreign_keys(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE contype = 'f' AND confrelid = %s::regclass",
+                [ProviderResponse._meta.db_table]
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_convert_and_revert(self):
+        foreign_keys = self.get_foreign_keys()
+        parent = create_response(self.provider, self.btc, 1)
+        child = create_response(self.provider, self.btc, 1, parent_response=parent)
+
+        partitions.convert('day')
+        partitions.create_partitions('day', 1)
+
+        self.assertTrue(partitions.is_partitioned())
+        self.assertEqual(self.get_foreign_keys(), set())
+
+        response = create_response(self.provider, self.btc, 1)
+
+        partitions.revert()
+
+        self.assertFalse(partitions.is_partitioned())
+        self.assertEqual(self.get_foreign_keys(), foreign_keys)
+        self.assertEqual(set(ProviderResponse.objects.all()), {parent, child, response})
+        # the id sequence carries on from where it was
+        self.assertGreater(create_response(self.provider, self.btc, 1).pk, response.pk)
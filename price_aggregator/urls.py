@@ -26,9 +26,11 @@ urlpatterns = [
     path('', views.IndexView.as_view()),
 
     path('price/<str:currency_code>', views.PriceView.as_view(), name='price'),
+    path('prices', views.PricesView.as_view(), name='prices'),
     path('currency/choose/<str:path>', views.CurrencyChooseView.as_view(), name='currency_choose'),
     path('price/<str:currency_code>/<str:date_time>', views.SpotPriceView.as_view(), name='spot_price'),
     path('movement/<str:currency_code>', views.PriceChangesView.as_view(), name='price'),
+    path('history/<str:currency_code>', views.HistoryView.as_view(), name='history'),
     path('currencies', views.CurrenciesView.as_view(), name='currencies'),
     path('providers', views.ProvidersView.as_view(), name='providers'),
     path('provider/choose/<str:path>', views.ProviderChooseView.as_view(), name='provider_choose'),
@@ -1,15 +1,61 @@
+import csv
 import datetime
+import itertools
 import json
+import math
+import re
 from statistics import mean
 
-from django.http import JsonResponse, HttpResponse
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.db.models.functions import Lower
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.utils.timezone import make_aware, now
 from django.views import View
 
 from price_aggregator.models import Currency, AggregatedPrice, Provider, ProviderResponse, ProviderFailure, \
-    ArbitrageOpportunity
+    ArbitrageOpportunity, ProviderCoverage
+from price_aggregator.snapshots import MOVEMENT_STYLE, get_full_price_renderings, get_price_snapshot, \
+    render_full_prices
+
+
+def validators(date_time, *variant):
+    """
+    Get the ETag and Last-Modified timestamp for a representation of data that last changed at date_time.
+    variant separates the different representations of the same data
+    """
+    return (
+        quote_etag('-'.join([str(date_time.timestamp())] + [str(part) for part in variant])),
+        int(date_time.timestamp())
+    )
+
+
+def is_stale(date_time):
+    """
+    Older prices are served with a warning, which changes their representation
+    """
+    return date_time < (now() - datetime.timedelta(hours=24))
+
+
+def conditional_response(request, date_time, build_response, *variant):
+    """
+    Answer a conditional request with 304 Not Modified if the client already has the data from date_time.
+    Otherwise build_response is called to make the full response.
+    Either way the ETag and Last-Modified headers are added
+    """
+    etag, last_modified = validators(date_time, *variant)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        response = build_response()
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
 
 
 class IndexView(View):
@@ -36,11 +82,25 @@ class IndexView(View):
                             'url': '{}/price/<currency_code>'.format(request_url),
                             'url_function': 'Display aggregated price data for the currency specified by <currency_code>'
                         },
+                        {
+                            'url': '{}/prices?codes=<currency_code>,<currency_code>'.format(request_url),
+                            'url_function': 'Display the latest aggregated price data for each of the comma '
+                                            'separated currency codes. Leave out codes to get every currency'
+                        },
                         {
                             'url': '{}/price/<currency_code>/<date_time>'.format(request_url),
                             'url_function': 'Display aggregated price data for the currency specified by <currency_code> '
                                             'at the date_time given by <date_time> (yyyy-mm-ddTHH:MM:SS)'
                         },
+                        {
+                            'url': '{}/history/<currency_code>?from=<date_time>&to=<date_time>&interval=5m'.format(
+                                request_url
+                            ),
+                            'url_function': 'Display open, high, low, close and mean aggregated prices for the '
+                                            'currency in buckets of interval (seconds or 5m, 1h, 1d) between from '
+                                            'and to (yyyy-mm-ddTHH:MM:SS). Defaults to the last 24 hours. '
+                                            'Add &format=csv for csv'
+                        },
                         {
                             'url': '{}/movement/<currency_code>'.format(request_url),
                             'url_function': 'Display the price movement over a range of times'
@@ -58,6 +118,14 @@ class IndexView(View):
                             'url_function': 'Display single provider data for the currency specified by <currency_code> '
                                             'at the date_time given by <date_time> (yyyy-mm-ddTHH:MM:SS)'
                         },
+                        {
+                            'url': '{}/ws/prices?codes=<currency_code>,<currency_code>'.format(
+                                request_url.replace('http', 'ws', 1)
+                            ),
+                            'url_function': 'WebSocket that pushes each new aggregated price for the comma separated '
+                                            'currency codes. Send {"subscribe": [<currency_code>]} or '
+                                            '{"unsubscribe": [<currency_code>]} to change currencies'
+                        },
                         {
                             'url': '{}/arbitrage/<currency_code>'.format(request_url),
                             'url_function': 'Display the ten most recent arbitrage opportunities for the currency '
@@ -81,6 +149,24 @@ class PriceView(View):
         if currency_code.lower() == 'nbt':
             currency_code = 'usnbt'
 
+        style = 'short'
+
+        if 'full' in request.GET:
+            style = 'full'
+
+        # the latest price is rendered when it is aggregated so can usually be sent straight from the cache
+        snapshot = get_price_snapshot(currency_code, style)
+
+        if snapshot is not None:
+            date_time, content = snapshot
+            return conditional_response(
+                request,
+                date_time,
+                lambda: HttpResponse(content, content_type='application/json'),
+                style,
+                is_stale(date_time)
+            )
+
         # get the currency
         currency = get_object_or_404(Currency, code__iexact=currency_code)
         # get the last aggregated price
@@ -95,12 +181,73 @@ class PriceView(View):
                 {'error': 'no aggregated prices found for the last 24 hours'}
             )
 
+        return conditional_response(
+            request,
+            agg_price.date_time,
+            lambda: JsonResponse(agg_price.serialize(style), json_dumps_params={'sort_keys': True}),
+            style,
+            is_stale(agg_price.date_time)
+        )
+
+
+class PricesView(View):
+    @staticmethod
+    def get(request):
+        currencies = Currency.objects.all()
+
+        # limit to the comma separated codes if any were given
+        if request.GET.get('codes'):
+            codes = [code.strip().lower() for code in request.GET['codes'].split(',') if code.strip()]
+            # Bittrex still calls USNBT NBT!
+            codes = ['usnbt' if code == 'nbt' else code for code in codes]
+            currencies = currencies.annotate(lower_code=Lower('code')).filter(lower_code__in=codes)
+
         style = 'short'
 
         if 'full' in request.GET:
             style = 'full'
 
-        return JsonResponse(agg_price.serialize(style), json_dumps_params={'sort_keys': True})
+        # the latest price of every currency comes from a single query
+        # and carries its own moving averages so they don't need calculating here
+        agg_prices = AggregatedPrice.objects.latest_per_currency().filter(
+            currency__in=currencies
+        ).select_related(
+            'currency'
+        )
+
+        if style == 'full':
+            return PricesView.get_full(agg_prices)
+
+        return JsonResponse(
+            {agg_price.currency.code: agg_price.serialize(style) for agg_price in agg_prices},
+            json_dumps_params={'sort_keys': True}
+        )
+
+    @staticmethod
+    def get_full(agg_prices):
+        """
+        The full renderings of recent prices are shared with the price endpoint through the snapshot cache.
+        Those that aren't stored yet are rendered together and stored.
+        Older prices carry a warning so are always rendered afresh
+        """
+        agg_prices = list(agg_prices)
+        recent_prices = [agg_price for agg_price in agg_prices if not is_stale(agg_price.date_time)]
+        old_prices = [agg_price for agg_price in agg_prices if is_stale(agg_price.date_time)]
+
+        contents = {pk: content for pk, (date_time, content) in get_full_price_renderings(recent_prices).items()}
+
+        if old_prices:
+            contents.update(render_full_prices(old_prices))
+
+        # the renderings are already JSON so are joined together rather than parsed and dumped again
+        renderings = {agg_price.currency.code: contents[agg_price.pk] for agg_price in agg_prices}
+
+        return HttpResponse(
+            b'{' + b', '.join(
+                json.dumps(code).encode() + b': ' + renderings[code] for code in sorted(renderings)
+            ) + b'}',
+            content_type='application/json'
+        )
 
 
 class CurrencyChooseView(View):
@@ -158,28 +305,28 @@ class SpotPriceView(View):
         if 'full' in request.GET:
             style = 'full'
 
-        return JsonResponse(agg_price.serialize(style), json_dumps_params={'sort_keys': True})
+        return conditional_response(
+            request,
+            agg_price.date_time,
+            lambda: JsonResponse(agg_price.serialize(style), json_dumps_params={'sort_keys': True}),
+            style,
+            is_stale(agg_price.date_time)
+        )
 
 
 class CurrenciesView(View):
     @staticmethod
     def get(request):
-        response = {}
-        currencies = Currency.objects.all()
-
-        for currency in currencies:
-            if 'full' in request.GET:
-                supported_providers = ProviderResponse.objects.filter(
-                    currency=currency,
-                    date_time__gte=now() - datetime.timedelta(days=1)
-                ).values_list(
-                    'provider__name',
-                    flat=True
-                )
-            else:
-                supported_providers = []
+        response = {currency.code: [] for currency in Currency.objects.all()}
 
-            response[currency.code] = list(set(supported_providers))
+        if 'full' in request.GET:
+            for currency_code, provider_name in ProviderCoverage.objects.current().order_by(
+                'provider__name'
+            ).values_list(
+                'currency__code',
+                'provider__name'
+            ):
+                response[currency_code].append(provider_name)
 
         return JsonResponse(response, json_dumps_params={'sort_keys': True})
 
@@ -204,20 +351,22 @@ class ProvidersView(View):
         providers = Provider.objects.all()
 
         for provider in providers:
-            supported_currencies = ProviderResponse.objects.filter(
-                provider=provider,
-                date_time__gte=now() - datetime.timedelta(days=1)
-            ).values_list(
-                'currency__code',
-                flat=True
-            )
             response[provider.name] = {
-                'supported_currencies': list(set(supported_currencies)),
+                'supported_currencies': [],
                 'url': '{}{}'.format(
                     request_url,
                     reverse('provider', kwargs={'provider': provider.name})
                 )
             }
+
+        for provider_name, currency_code in ProviderCoverage.objects.current().order_by(
+            'currency__code'
+        ).values_list(
+            'provider__name',
+            'currency__code'
+        ):
+            response[provider_name]['supported_currencies'].append(currency_code)
+
         return JsonResponse(response, json_dumps_params={'sort_keys': True})
 
 
@@ -231,23 +380,43 @@ class ProviderResponsesView(View):
         responses = ProviderResponse.objects.filter(
             provider=provider_obj,
             date_time__gte=now() - datetime.timedelta(days=1)
+        ).order_by(
+            'currency',
+            'date_time'
+        ).values_list(
+            'currency__code',
+            'date_time',
+            'value'
         )
 
-        return JsonResponse(
-            {
-                provider_obj.name: {
-                    resp.currency.code: {
-                        'responses': [
-                            {
-                                'date_time': response.date_time,
-                                'value': response.value
-                            } for response in responses.filter(currency=resp.currency).order_by('date_time')
-                        ]
-                    } for resp in responses.distinct('currency').order_by('currency')
-                }
-            }
+        return StreamingHttpResponse(
+            ProviderResponsesView.stream_json(provider_obj, responses),
+            content_type='application/json'
         )
 
+    @staticmethod
+    def stream_json(provider_obj, responses):
+        """
+        Yield the responses as JSON one currency group at a time.
+        A single ordered query is read from a cursor so the whole history is never held in memory
+        """
+        yield '{{{}: {{'.format(json.dumps(provider_obj.name))
+
+        for index, (currency_code, currency_responses) in enumerate(
+                itertools.groupby(responses.iterator(), key=lambda response: response[0])
+        ):
+            yield '{}{}: {{"responses": ['.format(', ' if index else '', json.dumps(currency_code))
+
+            for response_index, (_, date_time, value) in enumerate(currency_responses):
+                yield '{}{}'.format(
+                    ', ' if response_index else '',
+                    json.dumps({'date_time': date_time, 'value': value}, cls=DjangoJSONEncoder)
+                )
+
+            yield ']}'
+
+        yield '}}'
+
 
 class ProviderPriceView(View):
     @staticmethod
@@ -265,11 +434,8 @@ class ProviderPriceView(View):
             request_url = '{}://{}'.format(request.META.get('HTTP_X_FORWARDED_PROTO', 'http'), request.get_host())
             response = {}
 
-            for currency in provider_obj.providerresponse_set.all(
-            ).distinct(
-                'currency'
-            ).order_by(
-                'currency'
+            for currency in ProviderCoverage.objects.filter(
+                provider=provider_obj
             ).values_list(
                 'currency__code',
                 flat=True
@@ -286,18 +452,18 @@ class ProviderPriceView(View):
         # get the currency
         currency = get_object_or_404(Currency, code__iexact=currency_code)
 
-        # check the provider supports this currency
-        if currency.code not in ProviderResponse.objects.filter(
-            provider=provider_obj,
-        ).values_list(
-            'currency__code',
-            flat=True
-        ):
+        # get the latest response. There isn't one if the provider doesn't support this currency
+        last_response = ProviderCoverage.objects.latest_response(provider_obj, currency)
+
+        if last_response is None:
             return JsonResponse({'error': '{} is not supported by {}'.format(currency_code, provider)})
 
-        # get the latest response
-        last_response = provider_obj.providerresponse_set.filter(currency=currency).order_by('date_time').last()
-        return JsonResponse(last_response.serialize())
+        return conditional_response(
+            request,
+            last_response.date_time,
+            lambda: JsonResponse(last_response.serialize()),
+            is_stale(last_response.date_time)
+        )
 
 
 class ProviderSpotPriceView(View):
@@ -316,11 +482,8 @@ class ProviderSpotPriceView(View):
             request_url = '{}://{}'.format(request.META.get('HTTP_X_FORWARDED_PROTO', 'http'), request.get_host())
             response = {}
 
-            for currency in provider_obj.providerresponse_set.all(
-            ).distinct(
-                'currency'
-            ).order_by(
-                'currency'
+            for currency in ProviderCoverage.objects.filter(
+                provider=provider_obj
             ).values_list(
                 'currency__code',
                 flat=True
@@ -343,12 +506,7 @@ class ProviderSpotPriceView(View):
         currency = get_object_or_404(Currency, code__iexact=currency_code)
 
         # check the provider supports this currency
-        if currency.code not in ProviderResponse.objects.filter(
-                provider=provider_obj,
-        ).values_list(
-            'currency__code',
-            flat=True
-        ):
+        if not ProviderCoverage.objects.filter(provider=provider_obj, currency=currency).exists():
             return JsonResponse({'error': '{} is not supported by {}'.format(currency_code, provider)})
 
         # get the datetime
@@ -387,10 +545,144 @@ class PriceChangesView(View):
         if currency_code.lower() == 'nbt':
             currency_code = 'usnbt'
 
+        # the movements are calculated when the latest price is aggregated so can usually come from the cache
+        snapshot = get_price_snapshot(currency_code, MOVEMENT_STYLE)
+
+        if snapshot is not None:
+            date_time, content = snapshot
+            return conditional_response(
+                request,
+                date_time,
+                lambda: HttpResponse(content, content_type='application/json')
+            )
+
+        # get the currency
+        currency = get_object_or_404(Currency, code__iexact=currency_code)
+
+        # movements are measured from the latest aggregated price so only change when it does
+        latest_agg_price = currency.aggregatedprice_set.order_by('date_time').last()
+
+        if latest_agg_price is None:
+            return JsonResponse({'error': 'no aggregated prices found'})
+
+        return conditional_response(
+            request,
+            latest_agg_price.date_time,
+            lambda: JsonResponse(currency.currency_movements(latest_agg_price), json_dumps_params={'sort_keys': True})
+        )
+
+
+class Echo(object):
+    """
+    A file-like object that hands back what is written to it, so csv rows can be streamed
+    """
+    @staticmethod
+    def write(value):
+        return value
+
+
+def parse_interval(interval):
+    """
+    Turn an interval given as seconds or with an m, h or d suffix (300, 5m, 1h, 1d) into seconds.
+    Returns None if the interval isn't valid
+    """
+    match = re.match(r'^(\d+)([mhd]?)$', interval)
+
+    if not match or int(match.group(1)) == 0:
+        return None
+
+    return int(match.group(1)) * {'': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+
+class HistoryView(View):
+    columns = ['time', 'open', 'high', 'low', 'close', 'mean', 'samples']
+
+    @staticmethod
+    def format_row(row):
+        bucket, open_price, high, low, close, mean_price, samples = row
+        return [bucket] + [float('{:.8f}'.format(value)) for value in (open_price, high, low, close, mean_price)] + [
+            samples
+        ]
+
+    def get(self, request, currency_code):
+        if currency_code == '<currency_code>':
+            # this is a link from the front page. Allow user to choose a currency code to select
+            return redirect('currency_choose', path='{}|history|{}')
+
+        # Bittrex still calls USNBT NBT!
+        # TODO - handle multiple codes on model?
+        if currency_code.lower() == 'nbt':
+            currency_code = 'usnbt'
+
         # get the currency
         currency = get_object_or_404(Currency, code__iexact=currency_code)
 
-        return JsonResponse(currency.currency_movements())
+        # get the time range. By default this is the last 24 hours
+        try:
+            if 'to' in request.GET:
+                end = make_aware(datetime.datetime.strptime(request.GET['to'], "%Y-%m-%dT%H:%M:%S"))
+            else:
+                end = now()
+
+            if 'from' in request.GET:
+                start = make_aware(datetime.datetime.strptime(request.GET['from'], "%Y-%m-%dT%H:%M:%S"))
+            else:
+                start = end - datetime.timedelta(days=1)
+        except ValueError:
+            return JsonResponse(
+                {'error': 'The from and to parameters need to be passed in the format yyyy-mm-ddTHH:MM:SS'}
+            )
+
+        if start >= end:
+            return JsonResponse({'error': 'from needs to be before to'})
+
+        interval = parse_interval(request.GET.get('interval', '5m'))
+
+        if interval is None:
+            return JsonResponse(
+                {'error': 'The interval parameter needs to be a number of seconds or minutes, hours or days (5m, 1h, 1d)'}
+            )
+
+        # widen the buckets if needed to keep the number of points under the cap
+        interval = max(interval, math.ceil((end - start).total_seconds() / settings.HISTORY_MAX_POINTS))
+
+        rows = AggregatedPrice.objects.history(currency, start, end, interval)
+
+        if request.GET.get('format') == 'csv':
+            writer = csv.writer(Echo())
+            response = StreamingHttpResponse(
+                itertools.chain(
+                    [writer.writerow(self.columns)],
+                    (writer.writerow(self.format_row(row)) for row in rows)
+                ),
+                content_type='text/csv'
+            )
+            response['Content-Disposition'] = 'attachment; filename="{}_history.csv"'.format(currency.code.lower())
+            return response
+
+        return StreamingHttpResponse(
+            self.stream_json(currency, start, end, interval, rows),
+            content_type='application/json'
+        )
+
+    def stream_json(self, currency, start, end, interval, rows):
+        # the data list is left open so the rows can be added as they are read
+        yield json.dumps(
+            {
+                'currency': currency.code,
+                'from': start,
+                'to': end,
+                'interval': interval,
+                'columns': self.columns
+            },
+            cls=DjangoJSONEncoder,
+            separators=(',', ':')
+        )[:-1] + ',"data":['
+
+        for index, row in enumerate(rows):
+            yield '{}{}'.format(',' if index else '', json.dumps(self.format_row(row), separators=(',', ':')))
+
+        yield ']}'
 
 
 class ArbitrageOpportunitiesView(View):